@@ -1,31 +1,60 @@
 from a import create_topology
 from mininet.log import setLogLevel, info
+from mininet.util import pmonitor
+import argparse
 import re
 import statistics
 import time
 import os
 import logging 
+import json
+from latency_hist import LatencyHistogram
+
+RESULTS_FILE = "dns_test_results.json"
+DIG_FAILURE = "no servers could be reached"
 
 def parse_time(output):
     match = re.search(r"Query time: (\d+) msec", output)
     return int(match.group(1)) if match else None
 
+def load_urls(url_file):
+    if not os.path.exists(url_file):
+        info(f"URL file not found: {url_file}\n")
+        return None
+    with open(url_file) as f:
+        return [u.strip() for u in f if u.strip()]
+
+def summarize(host_name, urls, latencies, histogram, success, fail, total_data, wall_time):
+    avg_latency = statistics.mean(latencies) if latencies else float('nan')
+    throughput = (total_data / wall_time) if wall_time > 0 else 0
+    qps = len(urls) / wall_time if wall_time > 0 else 0
+
+    info(f"[{host_name}] URLs tested: {len(urls)}\n")
+    info(f"[{host_name}] Successful: {success}, Failed: {fail}\n")
+    info(f"[{host_name}] Average latency: {avg_latency:.2f} ms\n")
+    info(f"[{host_name}] Latency percentiles: {histogram.format_summary()}\n")
+    info(f"[{host_name}] Throughput: {throughput:.2f} bytes/sec ({qps:.2f} queries/sec over {wall_time:.2f} s)\n\n")
+
+    return {"host": host_name, "avg_latency": avg_latency,
+            "throughput": throughput, "qps": qps, "duration": wall_time,
+            "success": success, "fail": fail,
+            "latency": histogram.summary(), "cdf": histogram.cdf()}
+
 def test_dns(net, host_name, url_file, dns_server="8.8.8.8"):
     h = net.get(host_name)
     latencies, success, fail, total_data = [], 0, 0, 0
+    histogram = LatencyHistogram()
 
-    if not os.path.exists(url_file):
-        info(f"URL file not found: {url_file}\n")
+    urls = load_urls(url_file)
+    if urls is None:
         return None
 
-    with open(url_file) as f:
-        urls = [u.strip() for u in f if u.strip()]
-
     info(f"\n--- Testing host {host_name} with {len(urls)} URLs ---\n")
 
     info(f"[{host_name}] Setting DNS to {dns_server}\n")
     h.cmd(f"echo 'nameserver {dns_server}' > /etc/resolv.conf")
 
+    run_start = time.monotonic()
     for idx, url in enumerate(urls, start=1):
         info(f"[{host_name}] Querying ({idx}/{len(urls)}): {url} ... ")
         cmd = f"dig +stats @{dns_server} {url}"
@@ -34,25 +63,69 @@ def test_dns(net, host_name, url_file, dns_server="8.8.8.8"):
         if lookup_time is not None:
             success += 1
             latencies.append(lookup_time)
+            histogram.record(lookup_time * 1000)
             total_data += len(url)
             info(f"Success ({lookup_time} ms)\n")
         else:
             fail += 1
             info(f"Failed\n")
 
-    avg_latency = statistics.mean(latencies) if latencies else float('nan')
-    total_time = sum(latencies) / 1000 if latencies else 1
-    throughput = (total_data / total_time) if total_time > 0 else 0
+    wall_time = time.monotonic() - run_start
+    return summarize(host_name, urls, latencies, histogram, success, fail, total_data, wall_time)
+
+def test_dns_parallel(net, url_files, dns_server="8.8.8.8"):
+    popens, runs = {}, {}
+    for host_name, url_file in url_files.items():
+        urls = load_urls(url_file)
+        if urls is None:
+            continue
+        h = net.get(host_name)
+        info(f"[{host_name}] Setting DNS to {dns_server}, batching {len(urls)} URLs through dig -f\n")
+        h.cmd(f"echo 'nameserver {dns_server}' > /etc/resolv.conf")
+        runs[host_name] = {"urls": urls, "next": 0, "latencies": [], "histogram": LatencyHistogram(),
+                           "success": 0, "fail": 0, "total_data": 0, "start": time.monotonic(), "end": None}
+        popens[h] = h.popen(["dig", "+stats", f"@{dns_server}", "-f", os.path.abspath(url_file)])
+
+    for h, line in pmonitor(popens):
+        if h is None:
+            continue
+        run = runs[h.name]
+        run["end"] = time.monotonic()
+        if run["next"] >= len(run["urls"]):
+            continue
+
+        lookup_time = parse_time(line)
+        if lookup_time is not None:
+            url = run["urls"][run["next"]]
+            run["success"] += 1
+            run["latencies"].append(lookup_time)
+            run["histogram"].record(lookup_time * 1000)
+            run["total_data"] += len(url)
+        elif DIG_FAILURE in line:
+            url = run["urls"][run["next"]]
+            run["fail"] += 1
+        else:
+            continue
 
-    info(f"URLs tested: {len(urls)}\n")
-    info(f"Successful: {success}, Failed: {fail}\n")
-    info(f"Average latency: {avg_latency:.2f} ms\n")
-    info(f"Throughput: {throughput:.2f} bytes/sec\n\n")
+        run["next"] += 1
+        status = f"Success ({lookup_time} ms)" if lookup_time is not None else "Failed"
+        info(f"[{h.name}] ({run['next']}/{len(run['urls'])}) {url} ... {status}\n")
 
-    return {"host": host_name, "avg_latency": avg_latency,
-            "throughput": throughput, "success": success, "fail": fail}
+    results = []
+    for host_name, run in runs.items():
+        run["fail"] += len(run["urls"]) - run["next"]
+        wall_time = (run["end"] or time.monotonic()) - run["start"]
+        results.append(summarize(host_name, run["urls"], run["latencies"], run["histogram"],
+                                 run["success"], run["fail"], run["total_data"], wall_time))
+    return results
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parallel', action='store_true',
+                        help="query from all hosts at once, one batched dig -f per host")
+    parser.add_argument('--dns-server', default="8.8.8.8")
+    args = parser.parse_args()
+
     setLogLevel('info')
     logger = logging.getLogger()
     
@@ -66,15 +139,22 @@ def main():
     info("Logging to console and dns_test.log")
     net = create_topology()
 
-    results = []
-    for i in range(1, 5):
-        results.append(test_dns(net, f"h{i}", f"urls_h{i}.txt"))
+    url_files = {f"h{i}": f"urls_h{i}.txt" for i in range(1, 5)}
+    if args.parallel:
+        results = test_dns_parallel(net, url_files, args.dns_server)
+    else:
+        results = [test_dns(net, host_name, url_file, args.dns_server) for host_name, url_file in url_files.items()]
 
     for r in results:
         if r:
-            info(f"{r['host']}: {r['avg_latency']:.2f} ms | {r['throughput']:.2f} B/s | "
+            info(f"{r['host']}: {r['avg_latency']:.2f} ms | p99 {r['latency']['p99_ms']:.2f} ms | "
+                 f"{r['throughput']:.2f} B/s | {r['qps']:.2f} q/s | "
                  f"Success={r['success']} | Fail={r['fail']}\n")
 
+    with open(RESULTS_FILE, 'w') as f:
+        json.dump([r for r in results if r], f, indent=2)
+    info(f"Results written to {RESULTS_FILE}\n")
+
     net.stop()
 if __name__ == "__main__":
     main()
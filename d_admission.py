@@ -0,0 +1,191 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+
+from d_wire import RCODE_REFUSED, RCODE_SERVFAIL
+
+WORKER_LIMIT = 256
+QUEUE_DEPTH = 2048
+QUEUE_MAX_AGE = 1.5
+REAP_INTERVAL = 0.05
+CLIENT_RATE = 0
+CLIENT_BURST = 0
+SLIP = 2
+MAX_CLIENTS = 65536
+
+ALLOW, TRUNCATE, DROP = 0, 1, 2
+
+class RateLimiter:
+    def __init__(self, rate=CLIENT_RATE, burst=CLIENT_BURST, slip=SLIP, max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst or rate * 2
+        self.slip = slip
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.truncated = 0
+
+    def check(self, ip):
+        if self.rate <= 0:
+            return ALLOW
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(ip)
+            if bucket is None:
+                bucket = self.buckets[ip] = [self.burst, now, 0]
+                if len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(ip)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return ALLOW
+            bucket[2] += 1
+            if self.slip and bucket[2] % self.slip == 0:
+                self.truncated += 1
+                return TRUNCATE
+            self.dropped += 1
+            return DROP
+
+    def stats(self):
+        with self.lock:
+            return {"clients": len(self.buckets), "dropped": self.dropped, "truncated": self.truncated}
+
+class WorkQueue:
+    def __init__(self, handler, shed, workers=WORKER_LIMIT, depth=QUEUE_DEPTH, max_age=QUEUE_MAX_AGE):
+        self.handler = handler
+        self.shed = shed
+        self.workers = workers
+        self.max_age = max_age
+        self.depth = depth
+        self.queue = deque()
+        self.ready = threading.Condition()
+        self.slots = threading.BoundedSemaphore(workers)
+        self.lent = 0
+        self.shed_full = 0
+        self.shed_stale = 0
+
+    def start(self):
+        for _ in range(self.workers):
+            threading.Thread(target=self.run, daemon=True).start()
+        threading.Thread(target=self.reap, daemon=True).start()
+        return self
+
+    def submit(self, *args):
+        with self.ready:
+            if len(self.queue) < self.depth:
+                self.queue.append((time.monotonic(), args))
+                self.ready.notify()
+                return
+        self.shed_full += 1
+        self.shed(*args, RCODE_REFUSED)
+
+    def take(self):
+        with self.ready:
+            self.ready.wait_for(lambda: self.queue)
+            return self.queue.popleft()
+
+    def run(self):
+        while True:
+            enqueued_at, args = self.take()
+            with self.slots:
+                if time.monotonic() - enqueued_at > self.max_age:
+                    self.shed_stale += 1
+                    self.shed(*args, RCODE_SERVFAIL)
+                    continue
+                self.handler(*args)
+
+    def expire(self):
+        now = time.monotonic()
+        expired = []
+        with self.ready:
+            while self.queue and now - self.queue[0][0] > self.max_age:
+                expired.append(self.queue.popleft()[1])
+            wait = self.queue[0][0] + self.max_age - now if self.queue else self.max_age
+        for args in expired:
+            self.shed_stale += 1
+            self.shed(*args, RCODE_SERVFAIL)
+        return wait
+
+    def reap(self):
+        while True:
+            time.sleep(max(self.expire(), REAP_INTERVAL))
+
+    def borrow(self):
+        if not self.slots.acquire(blocking=False):
+            return False
+        self.lent += 1
+        return True
+
+    def give_back(self):
+        self.lent -= 1
+        self.slots.release()
+
+    def stats(self):
+        return {"workers": self.workers, "depth": len(self.queue), "lent": self.lent, "shed_full": self.shed_full, "shed_stale": self.shed_stale}
+
+class AsyncWorkQueue(WorkQueue):
+    def __init__(self, handler, shed, workers=WORKER_LIMIT, depth=QUEUE_DEPTH, max_age=QUEUE_MAX_AGE):
+        super().__init__(handler, shed, workers, depth, max_age)
+        self.tasks = set()
+
+    def start(self):
+        return self
+
+    def submit(self, *args):
+        self.expire()
+        if self.has_capacity():
+            self.spawn(args)
+        elif len(self.queue) < self.depth:
+            timer = asyncio.get_running_loop().call_later(self.max_age, self.expire)
+            self.queue.append((time.monotonic(), args, timer))
+        else:
+            self.shed_full += 1
+            self.shed(*args, RCODE_REFUSED)
+
+    def expire(self):
+        now = time.monotonic()
+        while self.queue and now - self.queue[0][0] >= self.max_age:
+            self.shed_stale += 1
+            self.shed(*self.queue.popleft()[1], RCODE_SERVFAIL)
+
+    def spawn(self, args):
+        task = asyncio.ensure_future(self.handler(*args))
+        self.tasks.add(task)
+        task.add_done_callback(self.finished)
+
+    def has_capacity(self):
+        return len(self.tasks) + self.lent < self.workers
+
+    def finished(self, task):
+        self.tasks.discard(task)
+        self.drain()
+
+    def drain(self):
+        self.expire()
+        while self.queue and self.has_capacity():
+            enqueued_at, args, timer = self.queue.popleft()
+            timer.cancel()
+            self.spawn(args)
+
+    def borrow(self):
+        if not self.has_capacity():
+            return False
+        self.lent += 1
+        return True
+
+    def give_back(self):
+        self.lent -= 1
+        self.drain()
+
+    def close(self):
+        for task in list(self.tasks):
+            task.cancel()
+        for enqueued_at, args, timer in self.queue:
+            timer.cancel()
+        self.queue.clear()
@@ -0,0 +1,227 @@
+import asyncio
+import signal
+import time
+from collections import deque
+
+import d_resolver
+from d_coalesce import AsyncInflightTable
+from d_admission import AsyncWorkQueue
+from d_tcp import AsyncTcpUpstreamPool, start_async_tcp_clients
+from d_upstream import AsyncUpstreamPool
+from d_resolver import (
+    SERVER_SELECTOR, STALE_CLIENT_TIMEOUT, METRICS, NS_LOOKUP_PARALLEL, QUERY_DEADLINE, RESOLVE_NS, FINISHED,
+    collect_upstream, log_event, usable_reply, process_response, use_ns_addresses, cached_ns_addresses, ns_candidates, ns_walk, store_ns_addresses,
+    merge_ns_walk, borrow_slot, give_back_slot, client_walk, store_result, finish_resolution, begin_query,
+    log_shared_result, send_reply, shed_query, admit, use_stale_or_refreshed, write_query_log
+)
+
+ASYNC_INFLIGHT = AsyncInflightTable()
+BACKGROUND_TASKS = set()
+ASYNC_UPSTREAM = AsyncUpstreamPool()
+ASYNC_TCP_UPSTREAM = AsyncTcpUpstreamPool()
+METRICS.gauge("dns_background_tasks", "Pending prefetch and NS lookup tasks")
+
+async def wait_reply(exchange, timeout, lame, more):
+    deadline = time.time() + timeout
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        done, _ = await asyncio.wait([exchange.replies], timeout=remaining)
+        if not done:
+            return None
+        reply = exchange.replies.result()
+        if usable_reply(reply[0], reply[1]):
+            return reply
+        lame[reply[0]] = reply[1]
+        exchange.replies = asyncio.get_running_loop().create_future()
+        if more or len(lame) == len(exchange.sent):
+            return None
+
+async def query_servers_async(upstream, packet, ips, servers_visited):
+    ordered = SERVER_SELECTOR.order(ips)
+    exchange = await upstream.exchange(packet)
+    lame = {}
+    reply = None
+    try:
+        for index, ip in enumerate(ordered):
+            servers_visited[0] += 1
+            upstream.send(exchange, ip, d_resolver.UPSTREAM_PORT)
+            more = index + 1 < len(ordered)
+            reply = await wait_reply(exchange, SERVER_SELECTOR.timeout(ip) if more else d_resolver.NETWORK_TIMEOUT, lame, more)
+            if reply:
+                break
+
+        if reply is None:
+            for ip in exchange.sent:
+                if ip not in lame:
+                    SERVER_SELECTOR.record_timeout(ip)
+            if lame:
+                return next(iter(lame.items()))
+            return ordered[0], None
+
+        winner, response, received = reply
+        SERVER_SELECTOR.record_rtt(winner, received - exchange.sent[winner])
+        for ip, sent_at in exchange.sent.items():
+            if ip != winner and ip not in lame and received - sent_at > SERVER_SELECTOR.timeout(ip):
+                SERVER_SELECTOR.record_timeout(ip)
+        if response.tc:
+            response = await ASYNC_TCP_UPSTREAM.query(winner, d_resolver.UPSTREAM_PORT, exchange.data, d_resolver.NETWORK_TIMEOUT)
+        return winner, response
+    finally:
+        exchange.replies.cancel()
+        upstream.finish(exchange)
+
+async def lookup_ns_async(walk, ns_hostname):
+    sub = ns_walk(walk, ns_hostname)
+    try:
+        await run_walk_async(ASYNC_UPSTREAM, sub)
+    except Exception:
+        sub.result = None
+    return sub, store_ns_addresses(walk, ns_hostname, sub)
+
+async def resolve_ns_addresses_async(walk):
+    cached_ips = cached_ns_addresses(walk)
+    if cached_ips:
+        return cached_ips
+
+    candidates = deque(ns_candidates(walk))
+    running = set()
+    while (candidates and not walk.expired()) or running:
+        while candidates and not walk.expired() and len(running) < NS_LOOKUP_PARALLEL and borrow_slot():
+            task = asyncio.ensure_future(lookup_ns_async(walk, candidates.popleft()))
+            task.add_done_callback(lambda task: give_back_slot())
+            BACKGROUND_TASKS.add(task)
+            task.add_done_callback(BACKGROUND_TASKS.discard)
+            running.add(task)
+        if running:
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            results = [task.result() for task in done]
+        else:
+            results = [await lookup_ns_async(walk, candidates.popleft())]
+        for sub, ips in results:
+            merge_ns_walk(walk, sub)
+            if ips:
+                return ips
+    return []
+
+async def run_walk_async(upstream, walk):
+    while True:
+        if walk.expired():
+            walk.fail("Query deadline exceeded | ")
+            return None
+        rtt_start = time.time()
+        contacted_ip, response_pkt = await query_servers_async(upstream, walk.query, walk.servers, walk.visited)
+        action = process_response(walk, contacted_ip, response_pkt, time.time() - rtt_start)
+        if action == RESOLVE_NS:
+            action = use_ns_addresses(walk, await resolve_ns_addresses_async(walk))
+        if action == FINISHED:
+            return walk.result
+
+async def resolve_and_store_async(key, query_log, servers_visited, negative_result):
+    final_answer = None
+    start_time = time.time()
+    try:
+        walk = client_walk(key, query_log, servers_visited, negative_result)
+        try:
+            await asyncio.wait_for(run_walk_async(ASYNC_UPSTREAM, walk), QUERY_DEADLINE)
+            final_answer = walk.answer()
+        except asyncio.TimeoutError:
+            log_event(query_log, f"RESOLUTION_FAILED: {key[0]} | Deadline exceeded | Total time to resolution: {time.time() - start_time:.4f}s")
+        store_result(key, final_answer, walk.answer_ttl, negative_result)
+    finally:
+        finish_resolution(ASYNC_INFLIGHT, key, final_answer, negative_result, servers_visited)
+    return final_answer
+
+async def refresh_entry_async(key):
+    query_log = []
+    try:
+        await resolve_and_store_async(key, query_log, [0], [None])
+    except Exception as e:
+        print(f"[REFRESH_FAILURE] {e}")
+    finally:
+        write_query_log(query_log)
+
+def start_refresh_async(key):
+    leader, pending = ASYNC_INFLIGHT.join(key)
+    if leader:
+        task = asyncio.ensure_future(refresh_entry_async(key))
+        BACKGROUND_TASKS.add(task)
+        task.add_done_callback(BACKGROUND_TASKS.discard)
+    return pending
+
+async def dispatch_query_async(data, client_address, listen_transport):
+    query_log = []
+    servers_visited_count = [0]
+    METRICS.inc("dns_queries_total")
+    METRICS.inc("dns_inflight_queries")
+
+    try:
+        negative_result = [None]
+        incoming_packet, key, lookup_start, hit, final_answer, stale = begin_query(data, query_log, negative_result, start_refresh_async)
+        if stale:
+            result = None if stale[2] else await ASYNC_INFLIGHT.wait(start_refresh_async(key), STALE_CLIENT_TIMEOUT)
+            final_answer = use_stale_or_refreshed(key, result, stale, query_log, lookup_start, negative_result)
+        elif not hit:
+            leader, pending = ASYNC_INFLIGHT.join(key)
+            if leader:
+                final_answer = await resolve_and_store_async(key, query_log, servers_visited_count, negative_result)
+            else:
+                final_answer, negative_result[0] = await ASYNC_INFLIGHT.wait(pending, QUERY_DEADLINE) or (None, None)
+                log_shared_result(query_log, key, "Coalesced", lookup_start, final_answer, negative_result)
+
+        send_reply(listen_transport, incoming_packet, client_address, final_answer, negative_result)
+
+    except Exception as e:
+        print(f"[WORKER_FAILURE] {e}")
+
+    finally:
+        METRICS.inc("dns_inflight_queries", n=-1)
+        write_query_log(query_log)
+
+@METRICS.collector
+def collect_async_state():
+    yield "dns_background_tasks", (), len(BACKGROUND_TASKS)
+    yield "dns_coalesced_inflight", (), ASYNC_INFLIGHT.stats()["in_flight"]
+    yield from collect_upstream(ASYNC_UPSTREAM, ASYNC_TCP_UPSTREAM)
+
+class ResolverProtocol(asyncio.DatagramProtocol):
+    def __init__(self, work_queue):
+        self.transport = None
+        self.work_queue = work_queue
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        admit(data, addr, self.transport, self.work_queue)
+
+    def error_received(self, exc):
+        print(f'[LISTENER_FAILURE] {exc}')
+
+async def init_async_resolver():
+    loop = asyncio.get_running_loop()
+    work_queue = d_resolver.WORK_QUEUE = AsyncWorkQueue(
+        dispatch_query_async, shed_query, d_resolver.WORKER_LIMIT, d_resolver.QUEUE_DEPTH, d_resolver.QUEUE_MAX_AGE
+    ).start()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: ResolverProtocol(work_queue), local_addr=(d_resolver.RESOLVER_IP, d_resolver.RESOLVER_PORT), reuse_port=d_resolver.REUSE_PORT or None
+    )
+    tcp_server = None
+    if d_resolver.TCP_LISTENER:
+        tcp_server = await start_async_tcp_clients(
+            d_resolver.RESOLVER_IP, d_resolver.RESOLVER_PORT, work_queue.submit, d_resolver.REUSE_PORT or None
+        )
+    print(f"Custom resolver (asyncio) active on {d_resolver.RESOLVER_IP}:{d_resolver.RESOLVER_PORT}")
+
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        transport.close()
+        work_queue.close()
+        if tcp_server is not None:
+            tcp_server.close()
+        ASYNC_UPSTREAM.close()
+        ASYNC_TCP_UPSTREAM.close()
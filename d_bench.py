@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from d_fakenet import FakeHierarchy, load_config
+from d_loadgen import run_load
+
+RESOLVER_ADDRESS = "127.0.1.53"
+RESOLVER_PORT = 10053
+UPSTREAM_PORT = 10054
+STARTUP_TIMEOUT = 10
+CONCURRENCY = 20
+WARM_REPEAT = 5
+MISSING_NAMES = 50
+TOLERANCE = 0.25
+SLACK_MS = 1.0
+RESULTS_FILE = "bench_results.json"
+
+def bench_names(hierarchy):
+    names = [name for zone in hierarchy.zones.values() for name, data in zone["records"].items()
+             if name.startswith(("web", "www", "alias", "huge"))]
+    names += [f"missing{i}.example.test." for i in range(MISSING_NAMES)]
+    random.Random(0).shuffle(names)
+    return names
+
+def start_resolver(mode, root, log_dir):
+    out_path = os.path.join(log_dir, f"resolver_{mode}.out")
+    out = open(out_path, "w")
+    proc = subprocess.Popen([
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "d_resolver.py"),
+        "--mode", mode, "--root", root,
+        "--address", RESOLVER_ADDRESS, "--port", str(RESOLVER_PORT), "--upstream-port", str(UPSTREAM_PORT),
+        "--log-level", "quiet", "--log-file", os.path.join(log_dir, f"resolver_{mode}.log"),
+    ], stdout=out, stderr=subprocess.STDOUT)
+    out.close()
+
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        with open(out_path) as f:
+            if "active on" in f.read():
+                return proc
+        if proc.poll() is not None:
+            break
+        time.sleep(0.05)
+    proc.kill()
+    with open(out_path) as f:
+        raise RuntimeError(f"resolver ({mode}) did not start:\n{f.read()}")
+
+def run_scenario(label, names, concurrency):
+    generator, duration = asyncio.run(run_load(RESOLVER_ADDRESS, names, port=RESOLVER_PORT, concurrency=concurrency))
+    results = generator.results(duration)
+    print(f"{label:<18} {results['total']:>6} q | ok {results['successful']:>6} | "
+          f"{results['achieved_qps']:>9.1f} q/s | {generator.histogram.format_summary()}")
+    return {"results": results, "latency": generator.histogram.summary(), "cdf": generator.histogram.cdf()}
+
+def run_suite(config_path=None, modes=("thread", "asyncio"), concurrency=CONCURRENCY):
+    fake = FakeHierarchy(load_config(config_path), UPSTREAM_PORT).start()
+    names = bench_names(fake.hierarchy)
+    report = {}
+    try:
+        with tempfile.TemporaryDirectory() as log_dir:
+            for mode in modes:
+                proc = start_resolver(mode, fake.root, log_dir)
+                try:
+                    upstream_before = sum(fake.stats.values())
+                    report[f"{mode}/cold"] = run_scenario(f"{mode}/cold", names, concurrency)
+                    report[f"{mode}/cold"]["upstream_queries"] = sum(fake.stats.values()) - upstream_before
+
+                    upstream_before = sum(fake.stats.values())
+                    report[f"{mode}/warm"] = run_scenario(f"{mode}/warm", names * WARM_REPEAT, concurrency)
+                    report[f"{mode}/warm"]["upstream_queries"] = sum(fake.stats.values()) - upstream_before
+                finally:
+                    proc.terminate()
+                    proc.wait()
+    finally:
+        fake.stop()
+    return report
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    regressions = []
+    for name, current in report.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            limit = previous["latency"][metric] * (1 + tolerance) + SLACK_MS
+            if current["latency"][metric] > limit:
+                regressions.append(f"{name} {metric}: {current['latency'][metric]:.3f} > {limit:.3f}")
+        if current["results"]["successful"] < previous["results"]["successful"]:
+            regressions.append(f"{name} successful: {current['results']['successful']} < {previous['results']['successful']}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', help="JSON hierarchy for d_fakenet (default: built-in sample)")
+    parser.add_argument('--mode', choices=['thread', 'asyncio'], action='append')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--results', default=RESULTS_FILE)
+    parser.add_argument('--baseline', help="earlier results file to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    report = run_suite(args.config, args.mode or ("thread", "asyncio"), args.concurrency)
+    with open(args.results, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.results}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"[REGRESSION] {line}")
+        sys.exit(1 if regressions else 0)
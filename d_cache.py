@@ -0,0 +1,220 @@
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_MAX_ENTRIES = 10000
+PREFETCH_MIN_HITS = 2
+PREFETCH_FRACTION = 0.1
+
+class AnswerCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, stale_window=0, stale_recheck=0):
+        self.max_entries = max_entries
+        self.stale_window = stale_window
+        self.stale_recheck = stale_recheck
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.prefetches = 0
+        self.stale_hits = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, ttl, hits, prefetching, failed_at = entry
+            if expires_at <= now:
+                if expires_at + self.stale_window <= now:
+                    del self.entries[key]
+                    self.expirations += 1
+                self.misses += 1
+                return None
+
+            entry[3] = hits = hits + 1
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            remaining = expires_at - now
+            prefetch = (not prefetching and hits >= PREFETCH_MIN_HITS and remaining < ttl * PREFETCH_FRACTION)
+            if prefetch:
+                entry[4] = True
+                self.prefetches += 1
+            return value, remaining, prefetch
+
+    def peek(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= now:
+                return None
+            return entry[0], entry[1] - now
+
+    def get_stale(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] > now or entry[1] + self.stale_window <= now:
+                return None
+            self.stale_hits += 1
+            return entry[0], now - entry[1], now - entry[5] < self.stale_recheck
+
+    def put(self, key, value, ttl):
+        if ttl is None or ttl <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = [value, time.monotonic() + ttl, ttl, 0, False, float('-inf')]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def export(self):
+        now = time.monotonic()
+        with self.lock:
+            return [(key, entry[0], entry[1] - now, entry[2]) for key, entry in self.entries.items()
+                    if entry[1] + self.stale_window > now]
+
+    def restore(self, key, value, remaining, ttl):
+        if remaining + self.stale_window <= 0:
+            return
+        with self.lock:
+            self.entries[key] = [value, time.monotonic() + remaining, ttl, 0, False, float('-inf')]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def release_prefetch(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry[4] = False
+
+    def refresh_failed(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry[5] = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "prefetches": self.prefetches,
+                "stale_hits": self.stale_hits,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+def cache_key(qname, qtype=1, qclass=1):
+    if isinstance(qname, bytes):
+        qname = qname.decode()
+    qname = qname.lower()
+    if not qname.endswith('.'):
+        qname += '.'
+    return (qname, int(qtype), int(qclass))
+
+class DelegationCache:
+    def __init__(self):
+        self.root = {"children": {}, "ns": None, "ips": None, "expires_at": 0}
+        self.lock = threading.Lock()
+        self.zones = 0
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, zone, ns_names, ips, ttl):
+        labels = zone_labels(zone)
+        if not labels or not ips or ttl is None or ttl <= 0:
+            return
+
+        with self.lock:
+            node = self.root
+            for label in labels:
+                node = node["children"].setdefault(label, {"children": {}, "ns": None, "ips": None, "expires_at": 0})
+            if node["ips"] is None:
+                self.zones += 1
+            node["ns"] = list(ns_names)
+            node["ips"] = list(dict.fromkeys(ips))
+            node["expires_at"] = time.monotonic() + ttl
+
+    def extend(self, zone, ns_names, ips, ttl):
+        labels = zone_labels(zone)
+        if not labels or not ips:
+            return
+
+        with self.lock:
+            node = self.root
+            for label in labels:
+                node = node["children"].get(label)
+                if node is None:
+                    break
+            if node is not None and node["ips"] is not None and node["expires_at"] > time.monotonic():
+                for ip in ips:
+                    if ip not in node["ips"]:
+                        node["ips"].append(ip)
+                return
+        self.put(zone, ns_names, ips, ttl)
+
+    def export(self):
+        now = time.monotonic()
+        zones = []
+        with self.lock:
+            stack = [(self.root, [])]
+            while stack:
+                node, labels = stack.pop()
+                if node["ips"] is not None and node["expires_at"] > now:
+                    zones.append((".".join(reversed(labels)) + ".", list(node["ns"]), list(node["ips"]), node["expires_at"] - now))
+                for label, child in node["children"].items():
+                    stack.append((child, labels + [label]))
+        return zones
+
+    def closest(self, qname):
+        labels = zone_labels(qname)
+        now = time.monotonic()
+        best_zone, best_ips = None, None
+
+        with self.lock:
+            node = self.root
+            for depth, label in enumerate(labels, start=1):
+                node = node["children"].get(label)
+                if node is None:
+                    break
+                if node["ips"] is None:
+                    continue
+                if node["expires_at"] <= now:
+                    node["ns"], node["ips"] = None, None
+                    self.zones -= 1
+                    continue
+                best_zone = ".".join(reversed(labels[:depth])) + "."
+                best_ips = list(node["ips"])
+
+            if best_zone is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best_zone, best_ips
+
+    def stats(self):
+        with self.lock:
+            return {"zones": self.zones, "hits": self.hits, "misses": self.misses}
+
+def zone_labels(name):
+    if isinstance(name, bytes):
+        name = name.decode()
+    name = name.lower().strip('.')
+    return list(reversed(name.split('.'))) if name else []
+
+def in_zone(name, zone):
+    zone = zone_labels(zone)
+    return zone_labels(name)[:len(zone)] == zone
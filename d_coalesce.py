@@ -0,0 +1,73 @@
+import asyncio
+import threading
+
+class InflightEntry:
+    __slots__ = ('event', 'result', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.waiters = 0
+
+class InflightTable:
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key):
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                entry = self.pending[key] = InflightEntry()
+                self.leaders += 1
+                return True, entry
+            entry.waiters += 1
+            self.coalesced += 1
+            return False, entry
+
+    def complete(self, key, result):
+        with self.lock:
+            entry = self.pending.pop(key, None)
+        if entry is not None:
+            entry.result = result
+            entry.event.set()
+
+    def wait(self, entry, timeout):
+        if entry.event.wait(timeout):
+            return entry.result
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": len(self.pending), "leaders": self.leaders, "coalesced": self.coalesced}
+
+class AsyncInflightTable:
+    def __init__(self):
+        self.pending = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key):
+        future = self.pending.get(key)
+        if future is None:
+            future = self.pending[key] = asyncio.get_running_loop().create_future()
+            self.leaders += 1
+            return True, future
+        self.coalesced += 1
+        return False, future
+
+    def complete(self, key, result):
+        future = self.pending.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    async def wait(self, future, timeout):
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def stats(self):
+        return {"in_flight": len(self.pending), "leaders": self.leaders, "coalesced": self.coalesced}
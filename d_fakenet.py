@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import random
+import threading
+
+from d_tcp import LENGTH, frame
+from d_wire import (
+    DNSWireError, Message, Record, build_response,
+    TYPE_A, TYPE_NS, TYPE_CNAME, TYPE_SOA, TYPE_AAAA, TYPE_MX, RCODE_NXDOMAIN, RCODE_REFUSED,
+)
+
+FAKE_PORT = 53
+DEFAULT_TTL = 300
+DEFAULT_NEGATIVE_TTL = 60
+DEFAULT_SEED = 0
+RECORD_TYPES = {TYPE_A: "A", TYPE_AAAA: "AAAA", TYPE_MX: "MX"}
+
+def sample_hierarchy(hosts=200):
+    example = {f"web{i}.example.test.": {"A": [f"10.9.{i // 250}.{i % 250 + 1}"]} for i in range(hosts)}
+    for i in range(10):
+        example[f"web{i}.example.test."]["AAAA"] = [f"fd00::9:{i + 1}", f"fd00::9:{i + 101}"]
+    example["example.test."] = {"MX": [[10, "web0.example.test."], [20, "web1.example.test."]]}
+    example["www.example.test."] = {"CNAME": "chain1.example.test."}
+    example["chain1.example.test."] = {"CNAME": "chain2.example.test."}
+    example["chain2.example.test."] = {"CNAME": "web0.example.test."}
+    example["alias.example.test."] = {"CNAME": "web1.glueless.test."}
+
+    glueless = {f"web{i}.glueless.test.": {"A": [f"10.8.{i // 250}.{i % 250 + 1}"]} for i in range(hosts // 4)}
+    lossy = {f"web{i}.lossy.test.": {"A": [f"10.7.{i // 250}.{i % 250 + 1}"]} for i in range(hosts // 4)}
+    big = {f"web{i}.big.test.": {"A": [f"10.6.{i}.{n + 1}" for n in range(40)]} for i in range(hosts // 20)}
+    big.update({f"huge{i}.big.test.": {"A": [f"10.5.{i}.{n + 1}" for n in range(100)]} for i in range(hosts // 20)})
+
+    return {
+        "servers": {
+            "127.0.0.10": {"latency": 0.002},
+            "127.0.0.11": {"latency": 0.005, "jitter": 0.002},
+            "127.0.0.12": {"latency": 0.010, "jitter": 0.005},
+            "127.0.0.13": {"latency": 0.020, "jitter": 0.010},
+            "127.0.0.14": {"latency": 0.010, "loss": 0.3},
+            "127.0.0.15": {"timeout": True},
+            "127.0.0.16": {"latency": 0.002},
+        },
+        "zones": {
+            ".": {"ns": {"a.root-servers.test.": "127.0.0.10"}, "ttl": 86400},
+            "test.": {"ns": {"a.gtld.test.": "127.0.0.11"}, "ttl": 3600},
+            "example.test.": {"ns": {"ns1.example.test.": "127.0.0.12", "ns2.example.test.": "127.0.0.15"}, "records": example},
+            "glueless.test.": {"ns": {"ns.glue-host.test.": "127.0.0.13"}, "glueless": True, "records": glueless},
+            "glue-host.test.": {"ns": {"ns.glue-host.test.": "127.0.0.13"}},
+            "lossy.test.": {"ns": {"ns1.lossy.test.": "127.0.0.14", "ns2.lossy.test.": "127.0.0.12"}, "records": lossy},
+            "big.test.": {"ns": {"ns.big.test.": "127.0.0.16"}, "records": big},
+        },
+    }
+
+def is_subdomain(name, zone):
+    return zone == '.' or name == zone or name.endswith('.' + zone)
+
+def zone_depth(zone):
+    return 0 if zone == '.' else zone.count('.')
+
+class Hierarchy:
+    def __init__(self, config):
+        self.servers = {ip: dict(options) for ip, options in config.get("servers", {}).items()}
+        self.zones = {}
+        for zone, options in config["zones"].items():
+            zone = zone.lower()
+            self.zones[zone] = {
+                "ns": {name.lower(): ip for name, ip in options["ns"].items()},
+                "records": {name.lower(): data for name, data in options.get("records", {}).items()},
+                "glueless": options.get("glueless", False),
+                "ttl": options.get("ttl", DEFAULT_TTL),
+                "negative_ttl": options.get("negative_ttl", DEFAULT_NEGATIVE_TTL),
+            }
+            for ip in options["ns"].values():
+                self.servers.setdefault(ip, {})
+
+        for zone in self.zones.values():
+            for name, ip in zone["ns"].items():
+                owner = self.authority_for(name)
+                if owner is not None and ip:
+                    owner["records"].setdefault(name, {}).setdefault("A", [ip])
+
+    def authority_for(self, name):
+        zones = [z for z in self.zones if is_subdomain(name, z)]
+        return self.zones[max(zones, key=zone_depth)] if zones else None
+
+    def soa(self, zone):
+        options = self.zones[zone]
+        negative_ttl = options["negative_ttl"]
+        rdata = (next(iter(options["ns"])), 'hostmaster.' + zone.lstrip('.'), 1, 3600, 600, 86400, negative_ttl)
+        return Record(zone, TYPE_SOA, negative_ttl, rdata)
+
+    def answer(self, ip, query):
+        question = query.qd
+        qname = question.qname.lower()
+        served = [z for z, options in self.zones.items() if ip in options["ns"].values() and is_subdomain(qname, z)]
+        if not served:
+            return build_response(query, RCODE_REFUSED)
+        zone = max(served, key=zone_depth)
+
+        cuts = [z for z in self.zones if z != zone and is_subdomain(z, zone) and is_subdomain(qname, z)]
+        if cuts:
+            child = min(cuts, key=zone_depth)
+            options = self.zones[child]
+            authority = [Record(child, TYPE_NS, options["ttl"], name) for name in options["ns"]]
+            glue = [] if options["glueless"] else [
+                Record(name, TYPE_A, options["ttl"], address) for name, address in options["ns"].items() if address
+            ]
+            return build_response(query, 0, authority=authority, additional=glue)
+
+        options = self.zones[zone]
+        data = options["records"].get(qname)
+        ttl = options["ttl"]
+        if data and "CNAME" in data:
+            return build_response(query, 0, answers=[Record(qname, TYPE_CNAME, ttl, data["CNAME"])], aa=1)
+        rtype = RECORD_TYPES.get(question.qtype)
+        if data and rtype in data:
+            answers = [Record(qname, question.qtype, ttl, tuple(value) if isinstance(value, list) else value) for value in data[rtype]]
+            return build_response(query, 0, answers=answers, aa=1)
+        if question.qtype == TYPE_NS and qname == zone:
+            return build_response(query, 0, answers=[Record(zone, TYPE_NS, ttl, name) for name in options["ns"]], aa=1)
+        if data or qname == zone or any(name.endswith('.' + qname) for name in options["records"]):
+            return build_response(query, 0, authority=[self.soa(zone)], aa=1)
+        return build_response(query, RCODE_NXDOMAIN, authority=[self.soa(zone)], aa=1)
+
+class FakeServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, hierarchy, ip, stats, seed=DEFAULT_SEED):
+        self.hierarchy = hierarchy
+        self.ip = ip
+        self.options = hierarchy.servers.get(ip, {})
+        self.stats = stats
+        self.random = random.Random(f"{seed}-{ip}")
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.stats[self.ip] = self.stats.get(self.ip, 0) + 1
+        if self.options.get("timeout") or self.random.random() < self.options.get("loss", 0):
+            return
+        try:
+            query = Message(data)
+            reply = self.hierarchy.answer(self.ip, query)
+            if len(reply) > query.udp_size:
+                reply = build_response(query, 0, tc=1)
+        except (DNSWireError, IndexError):
+            return
+
+        delay = self.options.get("latency", 0) + self.random.uniform(0, self.options.get("jitter", 0))
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.transport.sendto, reply, addr)
+        else:
+            self.transport.sendto(reply, addr)
+
+def fake_tcp_handler(hierarchy, ip, stats, seed=DEFAULT_SEED):
+    options = hierarchy.servers.get(ip, {})
+    rng = random.Random(f"{seed}-{ip}-tcp")
+
+    async def handle(reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                length = LENGTH.unpack(await reader.readexactly(LENGTH.size))[0]
+                data = await reader.readexactly(length)
+                stats[ip] = stats.get(ip, 0) + 1
+                if options.get("timeout"):
+                    continue
+                try:
+                    reply = frame(hierarchy.answer(ip, Message(data)))
+                except (DNSWireError, IndexError):
+                    continue
+                delay = options.get("latency", 0) + rng.uniform(0, options.get("jitter", 0))
+                loop.call_later(delay, lambda reply=reply: writer.is_closing() or writer.write(reply))
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+class FakeHierarchy:
+    def __init__(self, config=None, port=FAKE_PORT):
+        config = config or sample_hierarchy()
+        self.hierarchy = Hierarchy(config)
+        self.seed = config.get("seed", DEFAULT_SEED)
+        self.port = port
+        self.stats = {}
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+        self.error = None
+
+    @property
+    def root(self):
+        return next(iter(self.hierarchy.zones["."]["ns"].values()))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error:
+            raise self.error
+        return self
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        transports, servers = [], []
+        try:
+            for ip in self.hierarchy.servers:
+                transport, _ = self.loop.run_until_complete(self.loop.create_datagram_endpoint(
+                    lambda ip=ip: FakeServerProtocol(self.hierarchy, ip, self.stats, self.seed), local_addr=(ip, self.port)
+                ))
+                transports.append(transport)
+                servers.append(self.loop.run_until_complete(asyncio.start_server(
+                    fake_tcp_handler(self.hierarchy, ip, self.stats, self.seed), ip, self.port, reuse_address=True
+                )))
+        except OSError as e:
+            self.error = e
+            self.ready.set()
+            return
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            for transport in transports:
+                transport.close()
+            for server in servers:
+                server.close()
+            self.loop.close()
+
+    def stop(self):
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+def load_config(path):
+    if not path:
+        return sample_hierarchy()
+    with open(path) as f:
+        return json.load(f)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', help="JSON hierarchy (default: built-in sample)")
+    parser.add_argument('--port', type=int, default=FAKE_PORT)
+    parser.add_argument('--dump-config', action='store_true', help="print the sample hierarchy as JSON and exit")
+    args = parser.parse_args()
+
+    if args.dump_config:
+        print(json.dumps(sample_hierarchy(), indent=2))
+    else:
+        fake = FakeHierarchy(load_config(args.config), args.port).start()
+        for ip, options in fake.hierarchy.servers.items():
+            print(f"Fake server {ip}:{args.port} {options}")
+        print(f"Root: {fake.root} (run d_resolver.py --root {fake.root} --upstream-port {args.port})")
+        try:
+            fake.thread.join()
+        except KeyboardInterrupt:
+            fake.stop()
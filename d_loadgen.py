@@ -0,0 +1,161 @@
+import asyncio
+import random
+import time
+
+from d_wire import DNSWireError, Message, add_edns, build_query, TYPE_A
+from latency_hist import LatencyHistogram
+
+MAX_OUTSTANDING = 60000
+
+class LoadGenProtocol(asyncio.DatagramProtocol):
+    def __init__(self, pending):
+        self.pending = pending
+        self.stray = 0
+
+    def datagram_received(self, data, addr):
+        received = time.perf_counter_ns()
+        if len(data) < 2:
+            return
+        future = self.pending.get(int.from_bytes(data[:2], 'big'))
+        if future is None or future.done():
+            self.stray += 1
+            return
+        future.set_result((data, received))
+
+    def error_received(self, exc):
+        pass
+
+class LoadGenerator:
+    def __init__(self, server, port=53, timeout=5.0, sockets=1):
+        self.server = server
+        self.port = port
+        self.timeout = timeout
+        self.sockets = sockets
+        self.pending = {}
+        self.transports = []
+        self.protocols = []
+        self.sent = 0
+        self.successful = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.truncated = 0
+        self.dropped = 0
+        self.rcodes = {}
+        self.histogram = LatencyHistogram()
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        for _ in range(self.sockets):
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: LoadGenProtocol(self.pending), remote_addr=(self.server, self.port)
+            )
+            self.transports.append(transport)
+            self.protocols.append(protocol)
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+
+    def next_id(self):
+        while True:
+            qid = random.getrandbits(16)
+            if qid not in self.pending:
+                return qid
+
+    async def query(self, domain, qtype=TYPE_A):
+        if len(self.pending) >= MAX_OUTSTANDING:
+            self.dropped += 1
+            return
+
+        qid = self.next_id()
+        future = asyncio.get_running_loop().create_future()
+        self.pending[qid] = future
+        sent = time.perf_counter_ns()
+        self.transports[qid % len(self.transports)].sendto(add_edns(build_query(domain, qtype, qid=qid, rd=1)))
+        self.sent += 1
+
+        try:
+            data, received = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.failed += 1
+            return
+        finally:
+            self.pending.pop(qid, None)
+
+        self.histogram.record((received - sent) / 1000)
+
+        try:
+            response = Message(data)
+            self.rcodes[response.rcode] = self.rcodes.get(response.rcode, 0) + 1
+            self.truncated += response.tc
+            if response.rcode == 0 and any(record.type == qtype for record in response.an):
+                self.successful += 1
+                return
+        except DNSWireError:
+            pass
+        self.failed += 1
+
+    async def run_closed_loop(self, domains, concurrency):
+        if concurrency > MAX_OUTSTANDING:
+            raise ValueError(f"concurrency must be at most {MAX_OUTSTANDING}")
+        work = iter(domains)
+
+        async def worker():
+            for domain in work:
+                await self.query(domain)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def run_open_loop(self, domains, qps):
+        interval = 1.0 / qps
+        tasks = set()
+        start = time.perf_counter()
+
+        for i, domain in enumerate(domains):
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.ensure_future(self.query(domain))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    def results(self, duration):
+        total = self.sent + self.dropped
+        return {
+            "total": total,
+            "sent": self.sent,
+            "successful": self.successful,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "truncated": self.truncated,
+            "dropped": self.dropped,
+            "stray": sum(protocol.stray for protocol in self.protocols),
+            "rcodes": dict(self.rcodes),
+            "duration_s": duration,
+            "achieved_qps": self.sent / duration if duration > 0 else 0,
+            "avg_latency_ms": self.histogram.mean() / 1000,
+        }
+
+def expand_domains(domains, count):
+    if count is None or count <= len(domains):
+        return domains[:count] if count else domains
+    return [domains[i % len(domains)] for i in range(count)]
+
+async def run_load(server, domains, port=53, qps=None, concurrency=None, timeout=5.0, count=None, sockets=1):
+    generator = LoadGenerator(server, port, timeout, sockets)
+    await generator.open()
+    domains = expand_domains(domains, count)
+
+    start = time.perf_counter()
+    try:
+        if qps:
+            await generator.run_open_loop(domains, qps)
+        else:
+            await generator.run_closed_loop(domains, concurrency or 1)
+    finally:
+        generator.close()
+    return generator, time.perf_counter() - start
@@ -0,0 +1,80 @@
+import json
+import queue
+import threading
+from datetime import datetime
+
+LOG_FORMATS = ('text', 'jsonl')
+LOG_LEVELS = ('hop', 'query', 'quiet')
+BATCH_SIZE = 256
+
+def format_log_line(timestamp, message):
+    if timestamp is None:
+        return message
+    return f"[{datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}] {message}"
+
+def format_text(query_log):
+    return "\n".join(format_log_line(timestamp, message) for timestamp, message, _ in query_log) + "\n\n"
+
+def format_jsonl(query_log):
+    events = []
+    for timestamp, message, fields in query_log:
+        if timestamp is None:
+            continue
+        event = {"ts": timestamp, "event": message}
+        event.update(fields)
+        events.append(event)
+
+    record = {
+        "ts": events[0]["ts"] if events else None,
+        "final_state": "COMPLETE" if any("RESOLUTION_COMPLETE" in e["event"] for e in events) else "FAILED",
+        "events": events,
+    }
+    return json.dumps(record, separators=(',', ':')) + "\n"
+
+class LogWriter:
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.path = None
+        self.formatter = format_text
+        self.batches = 0
+        self.records = 0
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self, path, log_format='text'):
+        self.path = path
+        self.formatter = format_jsonl if log_format == 'jsonl' else format_text
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, query_log):
+        self.queue.put(query_log)
+
+    def run(self):
+        with open(self.path, 'a') as f:
+            while True:
+                batch = [self.queue.get()]
+                while len(batch) < BATCH_SIZE:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = None in batch
+                chunk = "".join(self.formatter(query_log) for query_log in batch if query_log is not None)
+                if chunk:
+                    f.write(chunk)
+                    f.flush()
+                    self.batches += 1
+                    self.records += len(batch) - stop
+                if stop:
+                    return
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,146 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RTT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+VISITED_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24)
+MAX_SHARDS = 256
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class Metrics:
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.retired = ({}, {})
+        self.shards_lock = threading.Lock()
+        self.help = {}
+        self.kinds = {}
+        self.buckets = {}
+        self.collectors = []
+
+    def counter(self, name, help_text):
+        self.help[name] = help_text
+        self.kinds[name] = "counter"
+
+    def gauge(self, name, help_text):
+        self.help[name] = help_text
+        self.kinds[name] = "gauge"
+
+    def histogram(self, name, help_text, buckets):
+        self.help[name] = help_text
+        self.kinds[name] = "histogram"
+        self.buckets[name] = buckets
+
+    def collector(self, func):
+        self.collectors.append(func)
+        return func
+
+    def shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = (threading.current_thread(), {}, {})
+            with self.shards_lock:
+                if len(self.shards) >= MAX_SHARDS:
+                    self.retire_dead()
+                self.shards.append(shard)
+            self.local.shard = shard
+        return shard
+
+    def retire_dead(self):
+        alive = []
+        for shard in self.shards:
+            if shard[0].is_alive():
+                alive.append(shard)
+            else:
+                merge_shard(self.retired, shard[1], shard[2])
+        self.shards = alive
+
+    def inc(self, name, labels=(), n=1):
+        counters = self.shard()[1]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + n
+
+    def observe(self, name, value, labels=()):
+        observations = self.shard()[2]
+        key = (name, labels)
+        entry = observations.get(key)
+        if entry is None:
+            entry = observations[key] = [[0] * (len(self.buckets[name]) + 1), 0, 0.0]
+        entry[0][bisect.bisect_left(self.buckets[name], value)] += 1
+        entry[1] += 1
+        entry[2] += value
+
+    def snapshot(self):
+        with self.shards_lock:
+            self.retire_dead()
+            totals = ({}, {})
+            merge_shard(totals, *self.retired)
+            for _, counters, observations in self.shards:
+                merge_shard(totals, dict(counters), dict(observations))
+        return totals
+
+    def render(self):
+        counters, observations = self.snapshot()
+        for collect in self.collectors:
+            for name, labels, value in collect():
+                counters[(name, labels)] = value
+
+        lines = []
+        for name, kind in self.kinds.items():
+            lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for (metric, labels), (counts, count, total) in sorted(observations.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, n in zip(self.buckets[name] + ("+Inf",), counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_count{format_labels(labels)} {count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            else:
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host, port):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+def merge_shard(totals, counters, observations):
+    for key, value in counters.items():
+        totals[0][key] = totals[0].get(key, 0) + value
+    for key, (counts, count, total) in observations.items():
+        entry = totals[1].get(key)
+        if entry is None:
+            totals[1][key] = [list(counts), count, total]
+            continue
+        entry[0] = [a + b for a, b in zip(entry[0], counts)]
+        entry[1] += count
+        entry[2] += total
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
@@ -3,44 +3,83 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import sys
+import os
+import pickle
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
-COMPLETE_RE = re.compile(r"RESOLUTION_COMPLETE: ([\w\.-]+) \| IP: ([\d\.]+) \| Total time to resolution: ([\d\.]+)s \| SERVERS_VISITED: (\d+)")
-RTT_RE = re.compile(r"Round-trip time: ([\d\.]+)s")
-QUERY_RE = re.compile(r"Domain name queried: ([\w\.-]+)")
+EVENT_RE = re.compile(
+    rb"Domain name queried: ([\w\.-]+)(?: \| Resolution mode: (\w+))?"
+    rb"|Round-trip time: ([\d\.]+)s"
+    rb"|RESOLUTION_COMPLETE: ([\w\.-]+) \| IP: (.+?) \| Total time to resolution: ([\d\.]+)s \| SERVERS_VISITED: (\d+)"
+)
+CHUNK_SIZE = 8 * 1024 * 1024
+COLUMNS = ("domain", "resolved_ip", "total_time_s", "servers_visited", "avg_rtt_s")
+CACHE_SUFFIX = ".parsed"
 
-def process_resolver_logs(log_path):
-    log_entries = []
-    current_rtts = []
-    current_domain = None
+def parse_chunk(chunk, columns, state):
+    domains, ips, totals, visited, avg_rtts = columns
+    current_domain, rtt_sum, rtt_count = state
+    for query, mode, rtt, domain, ip, total, servers in EVENT_RE.findall(chunk):
+        if query:
+            current_domain = query if mode in (b"", b"Iterative") else None
+            rtt_sum, rtt_count = 0.0, 0
+        elif rtt:
+            rtt_sum += float(rtt)
+            rtt_count += 1
+        elif domain == current_domain:
+            domains.append(domain.decode())
+            ips.append(ip.decode())
+            totals.append(float(total))
+            visited.append(int(servers))
+            avg_rtts.append(rtt_sum / rtt_count if rtt_count else 0.0)
+            current_domain, rtt_sum, rtt_count = None, 0.0, 0
+    return current_domain, rtt_sum, rtt_count
 
+def load_parse_cache(log_path, stat):
     try:
-        with open(log_path, "r", encoding="utf-8") as f:
-            for line in f:
-                query_match = QUERY_RE.search(line)
-                if query_match:
-                    current_domain = query_match.group(1)
-                    current_rtts = []
-                    continue
-
-                rtt_match = RTT_RE.search(line)
-                if rtt_match:
-                    current_rtts.append(float(rtt_match.group(1)))
-                    continue
-                
-                complete_match = COMPLETE_RE.search(line)
-                if complete_match and complete_match.group(1) == current_domain:
-                    avg_rtt = sum(current_rtts) / len(current_rtts) if current_rtts else 0.0
-                    
-                    log_entries.append({
-                        "domain": current_domain,
-                        "resolved_ip": complete_match.group(2),
-                        "total_time_s": float(complete_match.group(3)),
-                        "servers_visited": int(complete_match.group(4)),
-                        "avg_rtt_s": avg_rtt
-                    })
-                    current_domain = None
-                    current_rtts = []
+        with open(log_path + CACHE_SUFFIX, "rb") as f:
+            cached = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if cached["inode"] != stat.st_ino or cached["offset"] > stat.st_size:
+        return None
+    return cached
+
+def save_parse_cache(log_path, cached):
+    tmp_path = log_path + CACHE_SUFFIX + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, log_path + CACHE_SUFFIX)
+
+def process_resolver_logs(log_path, use_cache=True):
+    try:
+        stat = os.stat(log_path)
+        cached = load_parse_cache(log_path, stat) if use_cache else None
+        if cached is None:
+            cached = {"inode": stat.st_ino, "offset": 0, "state": (None, 0.0, 0), "columns": tuple([] for _ in COLUMNS)}
+
+        with open(log_path, "rb") as f:
+            f.seek(cached["offset"])
+            tail = b""
+            while True:
+                block = f.read(CHUNK_SIZE)
+                if not block:
+                    break
+                block = tail + block
+                cut = block.rfind(b"\n") + 1
+                chunk, tail = block[:cut], block[cut:]
+                cached["state"] = parse_chunk(chunk, cached["columns"], cached["state"])
+                cached["offset"] += len(chunk)
+
+        if use_cache:
+            save_parse_cache(log_path, cached)
+
+        columns = cached["columns"]
+        if tail:
+            partial = tuple([] for _ in COLUMNS)
+            parse_chunk(tail, partial, cached["state"])
+            columns = tuple(done + extra for done, extra in zip(columns, partial))
 
     except FileNotFoundError:
         print(f"Error: Log file not found at '{log_path}'")
@@ -49,7 +88,13 @@ def process_resolver_logs(log_path):
         print(f"Error parsing file: {e}")
         return pd.DataFrame()
 
-    return pd.DataFrame(log_entries)
+    if not columns[0]:
+        return pd.DataFrame()
+    return pd.DataFrame(dict(zip(COLUMNS, columns)))
+
+def process_many(log_paths):
+    with ProcessPoolExecutor(max_workers=min(len(log_paths), os.cpu_count() or 1)) as pool:
+        return dict(zip(log_paths, pool.map(process_resolver_logs, log_paths)))
 
 def generate_graphs(data):
     data = data.head(10)
@@ -87,8 +132,9 @@ def generate_graphs(data):
 
     print(f"\nPlots saved to {NAME}_dns_servers_visited.png, {NAME}_dns_total_time.png, and {NAME}_dns_average_rtt.png")
 
-def main():
-    data = process_resolver_logs(LOG_FILE)
+def main(data=None):
+    if data is None:
+        data = process_resolver_logs(LOG_FILE)
     if data.empty:
         print("No valid resolution records found in log.")
         sys.exit(1)
@@ -104,6 +150,8 @@ def main():
     print(f"Average RTT: {data.head(10)['avg_rtt_s'].mean():.4f} s")
 
 if __name__ == "__main__":
-    for NAME in ["h1", "h2", "h3", "h4"]:
+    names = sys.argv[1:] or ["h1", "h2", "h3", "h4"]
+    parsed = process_many([f"{name}_results.log" for name in names])
+    for NAME in names:
         LOG_FILE = f"{NAME}_results.log"
-        main()
+        main(parsed[LOG_FILE])
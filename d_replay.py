@@ -0,0 +1,139 @@
+import argparse
+import asyncio
+import mmap
+import time
+
+from d_loadgen import LoadGenerator, MAX_OUTSTANDING
+from d_wire import DNSWireError, Message
+from extract_pcap import capture_frames, dns_payloads
+from latency_hist import write_results
+
+RESOLVER_IP = "10.0.0.5"
+SPEED = 1.0
+CONCURRENCY = 30
+REPLAY_TIMEOUT = 5.0
+RESULTS_FILE = "replay_results.json"
+
+def trace_queries(mm, limit=None):
+    first = last = None
+    count = 0
+    for frame, linktype, ts in capture_frames(mm):
+        for dns in dns_payloads(frame, linktype):
+            try:
+                question = Message(dns).qd
+            except DNSWireError:
+                continue
+            if question is None or not question.qname:
+                continue
+            if ts is None:
+                ts = last if last is not None else 0.0
+            if first is None:
+                first = ts
+            last = max(ts, last if last is not None else ts)
+            yield last - first, question.qname, question.qtype
+            count += 1
+            if limit and count >= limit:
+                return
+
+class TraceReplayer(LoadGenerator):
+    def __init__(self, server, port=53, timeout=REPLAY_TIMEOUT, sockets=1):
+        super().__init__(server, port, timeout, sockets)
+        self.span = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.scheduled = 0
+
+    async def run_timed(self, queries, speed):
+        tasks = set()
+        start = time.perf_counter()
+        for offset, qname, qtype in queries:
+            self.span = offset
+            due = start + offset / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lag = max(0.0, time.perf_counter() - due)
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+            self.scheduled += 1
+            task = asyncio.ensure_future(self.query(qname, qtype))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def run_unpaced(self, queries, concurrency):
+        if concurrency > MAX_OUTSTANDING:
+            raise ValueError(f"concurrency must be at most {MAX_OUTSTANDING}")
+
+        async def worker():
+            for offset, qname, qtype in queries:
+                self.span = offset
+                await self.query(qname, qtype)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    def replay_results(self, duration, speed):
+        results = self.results(duration)
+        results["loss"] = (self.timeouts + self.dropped) / results["total"] if results["total"] else 0
+        results["trace_span_s"] = self.span
+        results["speed"] = speed or None
+        results["target_qps"] = results["total"] * speed / self.span if speed and self.span > 0 else None
+        results["max_schedule_lag_ms"] = self.max_lag * 1000
+        results["avg_schedule_lag_ms"] = self.total_lag / self.scheduled * 1000 if self.scheduled else 0
+        return results
+
+async def replay(pcap_file, server, port=53, speed=SPEED, concurrency=CONCURRENCY, timeout=REPLAY_TIMEOUT, limit=None, sockets=1):
+    replayer = TraceReplayer(server, port, timeout, sockets)
+    await replayer.open()
+    with open(pcap_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        queries = trace_queries(mm, limit)
+        start = time.perf_counter()
+        try:
+            if speed > 0:
+                await replayer.run_timed(queries, speed)
+            else:
+                await replayer.run_unpaced(queries, concurrency)
+        finally:
+            replayer.close()
+        duration = time.perf_counter() - start
+    return replayer, duration
+
+def execute_replay(pcap_file, server, port=53, speed=SPEED, concurrency=CONCURRENCY, timeout=REPLAY_TIMEOUT, limit=None, sockets=1, results_path=RESULTS_FILE):
+    mode = f"{speed:g}x trace speed" if speed > 0 else f"as fast as possible with {concurrency} outstanding"
+    print(f"Replaying {pcap_file} against {server}:{port} ({mode}):")
+
+    replayer, duration = asyncio.run(replay(pcap_file, server, port, speed, concurrency, timeout, limit, sockets))
+    results = replayer.replay_results(duration, speed)
+
+    print(f"\nTotal Queries Replayed: {results['total']}")
+    print(f"Number of successfully resolved queries: {results['successful']}")
+    print(f"Number of failed resolutions: {results['failed']} (timeouts: {results['timeouts']}, truncated: {results['truncated']}, dropped: {results['dropped']})")
+    print(f"Response codes: {results['rcodes']}")
+    print(f"Loss: {results['loss'] * 100:.2f}%")
+    print(f"Latency percentiles: {replayer.histogram.format_summary()}")
+    if results["target_qps"] is not None:
+        print(f"Target rate: {results['target_qps']:.2f} queries/sec ({results['trace_span_s']:.2f} s of trace at {speed:g}x)")
+        print(f"Schedule lag: avg {results['avg_schedule_lag_ms']:.3f} ms | max {results['max_schedule_lag_ms']:.3f} ms")
+    print(f"Achieved rate: {results['achieved_qps']:.2f} queries/sec")
+    print(f"Total Replay Duration: {duration:.2f} s")
+
+    results.update({"engine": "replay", "pcap": pcap_file, "server": server, "concurrency": None if speed > 0 else concurrency})
+    write_results(results_path, results, replayer.histogram)
+    print(f"Results written to {results_path}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pcap_file')
+    parser.add_argument('--server', default=RESOLVER_IP)
+    parser.add_argument('--port', type=int, default=53)
+    parser.add_argument('--speed', type=float, default=SPEED, help="trace time multiplier, e.g. 1 or 10; 0 sends as fast as possible")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help="queries kept outstanding when --speed is 0")
+    parser.add_argument('--timeout', type=float, default=REPLAY_TIMEOUT)
+    parser.add_argument('--limit', type=int, help="replay only the first N queries")
+    parser.add_argument('--sockets', type=int, default=1, help="source sockets to spread queries over (lets SO_REUSEPORT balance workers)")
+    parser.add_argument('--results', default=RESULTS_FILE, help="results file (.json or .csv)")
+    args = parser.parse_args()
+
+    execute_replay(args.pcap_file, args.server, args.port, args.speed, args.concurrency, args.timeout, args.limit, args.sockets, args.results)
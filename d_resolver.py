@@ -1,178 +1,798 @@
+import signal
 import socket
-from scapy.all import DNS, raw, DNSRR, DNSQR
+import argparse
+import asyncio
 import time
-from datetime import datetime
 import threading
+import queue
+from collections import deque
+from d_admission import (
+    ALLOW, TRUNCATE, CLIENT_BURST, CLIENT_RATE, QUEUE_DEPTH, QUEUE_MAX_AGE, WORKER_LIMIT, RateLimiter, WorkQueue,
+)
+from d_cache import AnswerCache, DelegationCache, cache_key, in_zone, zone_labels
+from d_coalesce import InflightTable
+from d_logger import LOG_FORMATS, LOG_LEVELS, LogWriter, format_log_line, format_text
+from d_metrics import Metrics, RTT_BUCKETS, VISITED_BUCKETS
+from d_snapshot import SNAPSHOT_INTERVAL, SnapshotError, load_snapshot, save_snapshot
+from d_srtt import ServerSelector
+from d_tcp import TcpUpstreamPool, serve_tcp_clients
+from d_upstream import UpstreamPool
+from d_wire import DNSWireError, Message, query_message, build_response, edns_record, TYPE_A, TYPE_CNAME, RCODE_NAMES
 
 ROOT_SERVER_IP = "198.41.0.4"
 LOG_MUTEX = threading.Lock()
 RESOLVER_IP = '10.0.0.5'
 RESOLVER_PORT = 53
+UPSTREAM_PORT = 53
+REUSE_PORT = False
+TCP_LISTENER = True
 LOG_FILE_NAME = 'resolver_events.log'
+LOG_LEVEL = 'hop'
+LOG_WRITER = LogWriter()
 NETWORK_TIMEOUT = 5
+COALESCE_WAIT = 30
+STALE_WINDOW = 86400
+STALE_ANSWER_TTL = 30
+STALE_CLIENT_TIMEOUT = 1.8
+STALE_RECHECK = 30
+MAX_NS_DEPTH = 4
+NS_LOOKUP_PARALLEL = 2
+QUERY_DEADLINE = 15
+MAX_CNAME_HOPS = 8
+MAX_REFERRALS = 16
+STAGE_NAMES = ["Root", "TLD", "Authoritative"]
+NEXT_SERVERS, RESOLVE_NS, FINISHED = 0, 1, 2
+NEGATIVE_TTL_CAP = 10800
+ANSWER_CACHE = AnswerCache(stale_window=STALE_WINDOW, stale_recheck=STALE_RECHECK)
+DELEGATION_CACHE = DelegationCache()
+NEGATIVE_CACHE = AnswerCache()
+SERVER_SELECTOR = ServerSelector(NETWORK_TIMEOUT)
+INFLIGHT = InflightTable()
+UPSTREAM_POOL = UpstreamPool()
+TCP_UPSTREAM = TcpUpstreamPool()
+RATE_LIMITER = RateLimiter()
+WORK_QUEUE = None
+SNAPSHOT_PATH = None
+SNAPSHOT_LOCK = threading.Lock()
+METRICS_HOST = '127.0.0.1'
+METRICS = Metrics()
+METRICS.counter("dns_queries_total", "Client queries received")
+METRICS.gauge("dns_inflight_queries", "Client queries currently being answered")
+METRICS.counter("dns_responses_total", "Replies sent to clients by rcode")
+METRICS.counter("dns_resolutions_total", "Upstream resolutions by result")
+METRICS.histogram("dns_upstream_rtt_seconds", "Upstream round-trip time per resolution stage", RTT_BUCKETS)
+METRICS.histogram("dns_servers_visited", "Upstream servers contacted per resolution", VISITED_BUCKETS)
+METRICS.gauge("dns_cache_hit_ratio", "Answer cache hit ratio")
+METRICS.counter("dns_cache_hits_total", "Answer cache lookups by result")
+METRICS.gauge("dns_cache_entries", "Entries held per cache")
+METRICS.counter("dns_upstream_timeouts_total", "Upstream timeouts per server")
+METRICS.gauge("dns_upstream_srtt_seconds", "Smoothed upstream RTT per server")
+METRICS.gauge("dns_coalesced_inflight", "Upstream walks shared by coalesced queries")
+METRICS.gauge("dns_threads", "Live resolver threads")
+METRICS.counter("dns_upstream_replies_total", "Upstream datagrams by validation result")
+METRICS.gauge("dns_upstream_pending", "Upstream exchanges awaiting a reply")
+METRICS.counter("dns_upstream_tcp_queries_total", "Truncated replies retried over TCP by result")
+METRICS.gauge("dns_upstream_tcp_connections", "Open persistent TCP connections to upstream servers")
+METRICS.counter("dns_queries_shed_total", "Client queries answered early by the admission queue")
+METRICS.counter("dns_queries_ratelimited_total", "Client queries over the per-client rate limit")
+METRICS.gauge("dns_queue_depth", "Client queries waiting for a worker")
 
-def log_event(query_log, message):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-    log_line = f"[{timestamp}] {message}"
-    print(log_line)
-    query_log.append(log_line)
+def log_event(query_log, message, **fields):
+    timestamp = time.time()
+    query_log.append((timestamp, message, fields))
+    if LOG_LEVEL == 'hop':
+        print(format_log_line(timestamp, message))
+
+def usable_reply(ip, response):
+    if response.rcode in (0, 3):
+        return True
+    SERVER_SELECTOR.record_timeout(ip)
+    return False
+
+def query_servers(upstream, packet, ips, servers_visited):
+    ordered = SERVER_SELECTOR.order(ips)
+    exchange = upstream.exchange(packet)
+    next_index = 0
+    next_send = deadline = 0
+    lame = {}
 
-def send_query(sock, packet, ip):
     try:
-        sock.sendto(raw(packet), (str(ip), 53))
-        data, _ = sock.recvfrom(4096)
-        return DNS(data)
-    except:
-        return None
-
-def get_additional_records(response):
-    ips = []
-    for i in range(response.arcount):
-        record = response.ar[i]
-        if record.type == 1:
-            ips.append(record.rdata)
+        while True:
+            now = time.time()
+            if next_index < len(ordered) and now >= next_send:
+                ip = ordered[next_index]
+                next_index += 1
+                servers_visited[0] += 1
+                try:
+                    upstream.send(exchange, ip, UPSTREAM_PORT)
+                except OSError:
+                    SERVER_SELECTOR.record_timeout(ip)
+                    continue
+                next_send = now + SERVER_SELECTOR.timeout(ip)
+                deadline = now + NETWORK_TIMEOUT
+
+            wait_until = deadline if next_index >= len(ordered) else min(next_send, deadline)
+            remaining = wait_until - time.time()
+            if remaining <= 0:
+                if next_index >= len(ordered):
+                    break
+                continue
+
+            reply = upstream.wait(exchange, remaining)
+            if reply is None:
+                continue
+
+            winner, response, received = reply
+            if not usable_reply(winner, response):
+                lame[winner] = response
+                next_send = 0
+                if next_index >= len(ordered) and len(lame) == len(exchange.sent):
+                    break
+                continue
+            SERVER_SELECTOR.record_rtt(winner, received - exchange.sent[winner])
+            for ip, sent_at in exchange.sent.items():
+                if ip != winner and ip not in lame and received - sent_at > SERVER_SELECTOR.timeout(ip):
+                    SERVER_SELECTOR.record_timeout(ip)
+            if response.tc:
+                response = TCP_UPSTREAM.query(winner, UPSTREAM_PORT, exchange.data, NETWORK_TIMEOUT)
+            return winner, response
+
+        for ip in exchange.sent:
+            if ip not in lame:
+                SERVER_SELECTOR.record_timeout(ip)
+        if lame:
+            return next(iter(lame.items()))
+        return ordered[0], None
+    finally:
+        upstream.finish(exchange)
+
+def get_additional_records(response, ns_names):
+    ns_names = {cache_key(name)[0] for name in ns_names}
+    return [record for record in response.ar if record.type == 1 and cache_key(record.rrname)[0] in ns_names]
+
+def follow_answer(response, qname, qtype):
+    chain, name = [], qname.lower()
+    for _ in range(MAX_CNAME_HOPS + 1):
+        rrset = [record for record in response.an if record.type == qtype and record.rrname.lower() == name]
+        if rrset or qtype == TYPE_CNAME:
+            return chain, rrset
+        cname = next((record for record in response.an if record.type == TYPE_CNAME and record.rrname.lower() == name), None)
+        if cname is None:
+            break
+        chain.append(cname)
+        name = cname.rdata.lower()
+    return chain, []
+
+def answer_rdata(answer, rtype=TYPE_A):
+    return [record.rdata for record in answer if record.type == rtype]
+
+def format_rdata(rdata):
+    if isinstance(rdata, tuple):
+        return ' '.join(format_rdata(value) for value in rdata)
+    if isinstance(rdata, bytes):
+        return rdata.hex()
+    return str(rdata)
+
+def answer_summary(answer):
+    return format_rdata(next((record.rdata for record in answer if record.type != TYPE_CNAME), answer[-1].rdata))
+
+def answer_with_ttl(answer, ttl):
+    records = []
+    for record in answer:
+        record = record.copy()
+        record.ttl = max(0, int(ttl(record.ttl)))
+        records.append(record)
+    return records
+
+def age_answer(answer, remaining):
+    elapsed = min(record.ttl for record in answer) - remaining
+    return answer_with_ttl(answer, lambda ttl: ttl - elapsed)
+
+def get_referral_ns(response):
+    zone, ns_names, ttl = None, [], None
+    for i in range(response.nscount):
+        record = response.ns[i]
+        if record.type == 2 and (zone is None or cache_key(record.rrname) == cache_key(zone)):
+            zone = record.rrname
+            ns_names.append(record.rdata)
+            ttl = record.ttl if ttl is None else min(ttl, record.ttl)
+    return zone, ns_names, ttl
+
+def is_delegation(zone_cut, current_zone, qname):
+    return in_zone(zone_cut, current_zone) and not in_zone(current_zone, zone_cut) and in_zone(qname, zone_cut)
+
+def get_soa_record(response):
+    for i in range(response.nscount):
+        record = response.ns[i]
+        if record.type == 6:
+            return record
+    return None
+
+def is_negative_response(response):
+    if response.rcode == 3:
+        return True
+    return response.rcode == 0 and not response.ancount and get_soa_record(response) is not None
+
+def starting_servers(qname, query_log):
+    zone, ips = DELEGATION_CACHE.closest(qname)
+    if zone is None:
+        return [ROOT_SERVER_IP], 0, '.'
+
+    log_event(query_log, f"Delegation cache hit: {zone} | Servers: {', '.join(str(ip) for ip in ips)}")
+    return ips, min(len(zone_labels(zone)), 2), zone
+
+class ResolutionWalk:
+    def __init__(self, query_pkt, query_log, servers_visited, depth=0, domain_name=None, start_time=None, chain=frozenset(), negative_result=None):
+        if isinstance(query_pkt, bytes):
+            query_pkt = Message(query_pkt)
+        if depth == 0:
+            domain_name = query_pkt.qd.qname
+            start_time = time.time()
+            log_event(query_log, f"Domain name queried: {domain_name} | Resolution mode: Iterative")
+
+        self.query = query_pkt
+        self.log = query_log
+        self.visited = servers_visited
+        self.depth = depth
+        self.domain_name = domain_name
+        self.start_time = start_time
+        self.chain = chain | {cache_key(query_pkt.qd.qname)[0]}
+        self.negative_result = [None] if negative_result is None else negative_result
+        self.answer_ttl = None
+        self.answer_records = []
+        self.cname_hops = 0
+        self.referrals = 0
+        self.referral = None
+        self.result = None
+        self.servers, self.level, self.zone = starting_servers(query_pkt.qd.qname, query_log)
+
+    def stage(self):
+        return STAGE_NAMES[min(self.level, 2)]
+
+    def expired(self):
+        return time.time() - self.start_time > QUERY_DEADLINE
+
+    def fail(self, reason=""):
+        log_event(self.log, f"RESOLUTION_FAILED: {self.domain_name} | {reason}Total time to resolution: {time.time() - self.start_time:.4f}s")
+        return FINISHED
+
+    def answer(self):
+        return tuple(self.answer_records) if self.result is not None else None
+
+def process_response(walk, contacted_ip, response_pkt, rtt):
+    resolution_step = walk.stage()
+    query_log = walk.log
+    METRICS.observe("dns_upstream_rtt_seconds", rtt, (("stage", resolution_step),))
+
+    if response_pkt is None:
+        log_event(query_log, f"DNS server IP contacted: {contacted_ip} ({resolution_step}) | Response: FAILED | Round-trip time: {rtt:.6f}s", stage=resolution_step, server=contacted_ip, rtt=rtt)
+        return walk.fail()
+
+    if is_negative_response(response_pkt):
+        status = "NXDOMAIN" if response_pkt.rcode == 3 else "NODATA"
+        log_event(query_log, f"DNS server IP contacted: {contacted_ip} ({resolution_step}) | Response or referral received: {status} | Round-trip time: {rtt:.6f}s", stage=resolution_step, server=contacted_ip, rtt=rtt)
+        walk.negative_result[0] = (response_pkt.rcode, get_soa_record(response_pkt), tuple(walk.answer_records))
+        if walk.depth == 0:
+            walk.fail(f"{status} | ")
+        return FINISHED
+
+    if response_pkt.ancount:
+        cnames, rrset = follow_answer(response_pkt, walk.query.qd.qname, walk.query.qd.qtype)
+        if not cnames and not rrset:
+            return FINISHED
+        for record in cnames + rrset:
+            walk.answer_ttl = record.ttl if walk.answer_ttl is None else min(walk.answer_ttl, record.ttl)
+        walk.answer_records.extend(cnames + rrset)
+
+        if rrset:
+            log_event(query_log, f"DNS server IP contacted: {contacted_ip} ({resolution_step}) | Response or referral received: ANSWER ({answer_summary(rrset)}) | Round-trip time: {rtt:.6f}s", stage=resolution_step, server=contacted_ip, rtt=rtt)
+            if walk.depth == 0:
+                log_event(query_log, f"RESOLUTION_COMPLETE: {walk.domain_name} | IP: {answer_summary(rrset)} | Total time to resolution: {time.time() - walk.start_time:.4f}s | SERVERS_VISITED: {walk.visited[0]}")
+            walk.result = rrset[0].rdata
+            return FINISHED
+
+        cname_target = cnames[-1].rdata
+        log_event(query_log, f"DNS server IP contacted: {contacted_ip} ({resolution_step}) | Response or referral received: CNAME ({cname_target}) | Round-trip time: {rtt:.6f}s", stage=resolution_step, server=contacted_ip, rtt=rtt)
+        walk.cname_hops += len(cnames)
+        if walk.cname_hops > MAX_CNAME_HOPS or cache_key(cname_target)[0] in walk.chain:
+            return walk.fail("CNAME loop | ")
+        walk.chain = walk.chain | {cache_key(record.rdata)[0] for record in cnames[:-1]} | {cache_key(cname_target)[0]}
+        walk.query = query_message(cname_target, walk.query.qd.qtype)
+        walk.servers, walk.level, walk.zone = starting_servers(cname_target, query_log)
+        walk.referrals = 0
+        return NEXT_SERVERS
+
+    if response_pkt.nscount > 0 and response_pkt.ns[0].type == 2:
+        referral = response_pkt.ns[0].rdata
+        log_event(query_log, f"DNS server IP contacted: {contacted_ip} ({resolution_step}) | Response or referral received: REFERRAL ({referral}) | Round-trip time: {rtt:.6f}s", stage=resolution_step, server=contacted_ip, rtt=rtt)
+        walk.level += 1
+        walk.referrals += 1
+        zone_cut, ns_names, ns_ttl = get_referral_ns(response_pkt)
+        glue_records = get_additional_records(response_pkt, ns_names)
+
+        if not is_delegation(zone_cut, walk.zone, walk.query.qd.qname):
+            return walk.fail(f"Referral to {zone_cut} does not descend below {walk.zone} | ")
+        if walk.referrals > MAX_REFERRALS:
+            return walk.fail("Referral limit reached | ")
+        trusted_glue = [record.rdata for record in glue_records if in_zone(record.rrname, walk.zone)]
+        DELEGATION_CACHE.put(zone_cut, ns_names, trusted_glue, ns_ttl)
+        walk.zone = zone_cut
+
+        if glue_records:
+            walk.servers = [record.rdata for record in glue_records]
+            return NEXT_SERVERS
+
+        walk.referral = (zone_cut, ns_names, ns_ttl)
+        return RESOLVE_NS
+
+    return FINISHED
+
+def use_ns_addresses(walk, ips):
+    walk.referral = None
+    if not ips:
+        log_event(walk.log, f"NS resolution failed")
+        return walk.fail()
+    walk.servers = ips
+    return NEXT_SERVERS
+
+def cached_ns_addresses(walk):
+    zone_cut, ns_names, ns_ttl = walk.referral
+    cached_ips = []
+    for ns_hostname in ns_names:
+        cached = ANSWER_CACHE.peek(cache_key(ns_hostname))
+        if cached:
+            cached_ips.extend(answer_rdata(cached[0]))
+    if cached_ips:
+        DELEGATION_CACHE.extend(zone_cut, ns_names, cached_ips, ns_ttl)
+    return cached_ips
+
+def ns_candidates(walk):
+    candidates = [ns_hostname for ns_hostname in walk.referral[1] if cache_key(ns_hostname)[0] not in walk.chain]
+    if walk.depth + 1 > MAX_NS_DEPTH or not candidates:
+        log_event(walk.log, f"NS resolution skipped: depth {walk.depth + 1} or delegation loop")
+        return []
+    for ns_hostname in candidates:
+        log_event(walk.log, f"Resolving NS record: {ns_hostname}")
+    return candidates
+
+def ns_walk(walk, ns_hostname):
+    return ResolutionWalk(query_message(ns_hostname), [], [0], walk.depth + 1, walk.domain_name, walk.start_time, walk.chain)
+
+def store_ns_addresses(walk, ns_hostname, sub):
+    ips = answer_rdata(sub.answer_records) if sub.result is not None else []
+    if ips:
+        zone_cut, ns_names, ns_ttl = walk.referral
+        ANSWER_CACHE.put(cache_key(ns_hostname), tuple(sub.answer_records), sub.answer_ttl)
+        DELEGATION_CACHE.extend(zone_cut, ns_names, ips, ns_ttl)
     return ips
 
-def perform_iterative_resolution(sock, query_pkt, query_log, servers_visited, depth=0, domain_name=None, start_time=None):
-    if isinstance(query_pkt, bytes):
-        query_pkt = DNS(query_pkt)
+def merge_ns_walk(walk, sub):
+    walk.log.extend(sub.log)
+    walk.visited[0] += sub.visited[0]
+
+def borrow_slot():
+    return WORK_QUEUE is not None and WORK_QUEUE.borrow()
+
+def give_back_slot():
+    WORK_QUEUE.give_back()
 
-    stage_level = [0]
-    stage_names = ["Root", "TLD", "Authoritative"]
+def lookup_ns(walk, ns_hostname):
+    sub = ns_walk(walk, ns_hostname)
+    try:
+        run_walk(UPSTREAM_POOL, sub)
+    except Exception:
+        sub.result = None
+    return sub, store_ns_addresses(walk, ns_hostname, sub)
 
-    if depth == 0:
-        domain_name = str(query_pkt.qd.qname.decode() if isinstance(query_pkt.qd.qname, bytes) else query_pkt.qd.qname)
-        start_time = time.time()
-        log_event(query_log, f"Domain name queried: {domain_name} | Resolution mode: Iterative")
+def background_ns_lookup(walk, ns_hostname, results):
+    try:
+        results.put(lookup_ns(walk, ns_hostname))
+    finally:
+        give_back_slot()
 
-    next_server_ips = [ROOT_SERVER_IP]
-    response_pkt = None
+def resolve_ns_addresses(walk):
+    cached_ips = cached_ns_addresses(walk)
+    if cached_ips:
+        return cached_ips
 
+    candidates = deque(ns_candidates(walk))
+    results = queue.SimpleQueue()
+    running = 0
+    while (candidates and not walk.expired()) or running:
+        while candidates and not walk.expired() and running < NS_LOOKUP_PARALLEL and borrow_slot():
+            threading.Thread(target=background_ns_lookup, args=(walk, candidates.popleft(), results), daemon=True).start()
+            running += 1
+        if running:
+            sub, ips = results.get()
+            running -= 1
+        else:
+            sub, ips = lookup_ns(walk, candidates.popleft())
+        merge_ns_walk(walk, sub)
+        if ips:
+            return ips
+    return []
+
+def run_walk(upstream, walk):
     while True:
-        resolution_step = stage_names[min(stage_level[0], 2)]
-        rtt_start = time.time()
-        contacted_ip = next_server_ips[0]
-
-        for ip in next_server_ips:
-            servers_visited[0] += 1
-            response_pkt = send_query(sock, query_pkt, ip)
-            if response_pkt:
-                contacted_ip = ip
-                break
-        
-        rtt = time.time() - rtt_start
-        
-        if response_pkt is None:
-            log_event(query_log, f"DNS server IP contacted: {contacted_ip} ({resolution_step}) | Response: FAILED | Round-trip time: {rtt:.6f}s")
-            log_event(query_log, f"RESOLUTION_FAILED: {domain_name} | Total time to resolution: {time.time() - start_time:.4f}s")
+        if walk.expired():
+            walk.fail("Query deadline exceeded | ")
             return None
+        rtt_start = time.time()
+        contacted_ip, response_pkt = query_servers(upstream, walk.query, walk.servers, walk.visited)
+        action = process_response(walk, contacted_ip, response_pkt, time.time() - rtt_start)
+        if action == RESOLVE_NS:
+            action = use_ns_addresses(walk, resolve_ns_addresses(walk))
+        if action == FINISHED:
+            return walk.result
 
-        if response_pkt.ancount:
-            for record in response_pkt.an:
-                if record.type == 1:
-                    log_event(query_log, f"DNS server IP contacted: {contacted_ip} ({resolution_step}) | Response or referral received: ANSWER ({record.rdata}) | Round-trip time: {rtt:.6f}s")
-                    if depth == 0:
-                        total_duration = time.time() - start_time
-                        log_event(query_log, f"RESOLUTION_COMPLETE: {domain_name} | IP: {record.rdata} | Total time to resolution: {total_duration:.4f}s | SERVERS_VISITED: {servers_visited[0]}")
-                    return record.rdata
-                
-                elif record.type == 5:
-                    cname_target = record.rdata.decode()
-                    log_event(query_log, f"DNS server IP contacted: {contacted_ip} ({resolution_step}) | Response or referral received: CNAME ({cname_target}) | Round-trip time: {rtt:.6f}s")
-                    query_pkt = DNS(qd=DNSQR(qname=cname_target))
-                    next_server_ips = [ROOT_SERVER_IP]
-                    stage_level = [0]
-                    break
-            else:
-                continue
+def negative_ttl(soa_record):
+    return min(soa_record.ttl, soa_record.minimum, NEGATIVE_TTL_CAP)
 
-        elif response_pkt.nscount > 0:
-            if response_pkt.ns[0].type == 2:
-                referral = response_pkt.ns[0].rdata.decode()
-                log_event(query_log, f"DNS server IP contacted: {contacted_ip} ({resolution_step}) | Response or referral received: REFERRAL ({referral}) | Round-trip time: {rtt:.6f}s")
-                stage_level[0] += 1
-                
-                glue_records = get_additional_records(response_pkt)
-                if glue_records:
-                    next_server_ips = glue_records
-                    continue
+def build_reply(incoming_packet, rcode, an=(), ns=(), ar=()):
+    return build_response(incoming_packet, rcode, answers=an, authority=ns, additional=ar)
 
-                new_ns_ips = []
-                for i in range(response_pkt.nscount):
-                    ns_hostname = response_pkt.ns[i].rdata
-                    log_event(query_log, f"Resolving NS record: {ns_hostname.decode()}")
-
-                    ip = perform_iterative_resolution(
-                        sock, DNS(qd=DNSQR(qname=ns_hostname)), query_log, 
-                        servers_visited, depth + 1, domain_name, start_time
-                    )
-                    if ip:
-                        new_ns_ips.append(ip)
-
-                if not new_ns_ips:
-                    log_event(query_log, f"NS resolution failed")
-                    log_event(query_log, f"RESOLUTION_FAILED: {domain_name} | Total time to resolution: {time.time() - start_time:.4f}s")
-                    return None
-                
-                next_server_ips = new_ns_ips
-            else:
-                return None
-        else:
-            return None
+def log_shared_result(query_log, key, mode, lookup_start, final_answer, negative_result):
+    log_event(query_log, f"Domain name queried: {key[0]} | Resolution mode: {mode}")
+    if final_answer:
+        log_event(query_log, f"RESOLUTION_COMPLETE: {key[0]} | IP: {answer_summary(final_answer)} | Total time to resolution: {time.time() - lookup_start:.4f}s | SERVERS_VISITED: 0")
+    elif negative_result[0]:
+        log_event(query_log, f"RESOLUTION_FAILED: {key[0]} | {'NXDOMAIN' if negative_result[0][0] == 3 else 'NODATA'} | Total time to resolution: {time.time() - lookup_start:.4f}s")
+    else:
+        log_event(query_log, f"RESOLUTION_FAILED: {key[0]} | Total time to resolution: {time.time() - lookup_start:.4f}s")
+
+def lookup_cached(key, query_log, lookup_start, negative_result, start_refresh=None):
+    cached = ANSWER_CACHE.get(key)
+    if cached:
+        final_answer = age_answer(cached[0], cached[1])
+        log_shared_result(query_log, key, "Cache", lookup_start, final_answer, negative_result)
+        if cached[2] and start_refresh:
+            start_refresh(key)
+        return True, final_answer
+
+    negative_cached = NEGATIVE_CACHE.get(key)
+    if negative_cached:
+        rcode, soa_record, chain = negative_cached[0]
+        elapsed = soa_record.ttl - negative_cached[1]
+        chain = answer_with_ttl(chain, lambda ttl: ttl - elapsed)
+        soa_record = soa_record.copy()
+        soa_record.ttl = int(negative_cached[1])
+        negative_result[0] = (rcode, soa_record, chain)
+        log_shared_result(query_log, key, "Cache", lookup_start, None, negative_result)
+        return True, None
+
+    return False, None
+
+def store_result(key, final_answer, answer_ttl, negative_result):
+    if final_answer:
+        ANSWER_CACHE.put(key, final_answer, answer_ttl)
+    elif negative_result[0] and negative_result[0][1] is not None:
+        rcode, soa_record, chain = negative_result[0]
+        soa_record = soa_record.copy()
+        soa_record.ttl = min([negative_ttl(soa_record)] + [record.ttl for record in chain])
+        negative_result[0] = (rcode, soa_record, chain)
+        NEGATIVE_CACHE.put(key, negative_result[0], soa_record.ttl)
+
+def send_reply(transport, incoming_packet, client_address, final_answer, negative_result):
+    domain_to_query = incoming_packet.qd.qname
+    rcode = 0 if final_answer else negative_result[0][0] if negative_result[0] else 2
+    METRICS.inc("dns_responses_total", (("rcode", RCODE_NAMES.get(rcode, rcode)),))
+    additional = [edns_record()] if incoming_packet.opt else []
+    if final_answer:
+        reply_packet = build_reply(incoming_packet, 0, an=final_answer, ar=additional)
+        summary = answer_summary(final_answer)
+    elif negative_result[0]:
+        rcode, soa_record, chain = negative_result[0]
+        reply_packet = build_reply(incoming_packet, rcode, an=chain, ns=[soa_record] if soa_record else [], ar=additional)
+        summary = 'NXDOMAIN' if rcode == 3 else 'NODATA'
+    else:
+        reply_packet = build_reply(incoming_packet, 2, ar=additional)
+        summary = 'SERVFAIL'
+
+    if len(reply_packet) > getattr(transport, 'max_message_size', incoming_packet.udp_size):
+        reply_packet = build_response(incoming_packet, rcode, additional=additional, tc=1)
+    transport.sendto(reply_packet, client_address)
+    if LOG_LEVEL != 'quiet':
+        print(f"[REPLY] {domain_to_query} -> {summary} (to {client_address[0]})")
+
+def write_query_log(query_log):
+    if not query_log or "RESOLUTION_COMPLETE" not in query_log[-1][1]:
+        query_log.append((None, "[FINAL_STATE: FAILED]", {}))
+
+    if LOG_WRITER.running:
+        LOG_WRITER.submit(query_log)
+        return
+
+    with LOG_MUTEX:
+        with open(LOG_FILE_NAME, 'a') as f:
+            f.write(format_text(query_log))
+
+def client_walk(key, query_log, servers_visited, negative_result):
+    return ResolutionWalk(query_message(key[0], key[1]), query_log, servers_visited, negative_result=negative_result)
+
+def finish_resolution(inflight, key, final_answer, negative_result, servers_visited):
+    if not final_answer:
+        ANSWER_CACHE.release_prefetch(key)
+        if not negative_result[0]:
+            ANSWER_CACHE.refresh_failed(key)
+    inflight.complete(key, (final_answer, negative_result[0]))
+    record_resolution(final_answer, negative_result, servers_visited)
+
+def resolve_and_store(key, query_log, servers_visited, negative_result):
+    final_answer = None
+    try:
+        walk = client_walk(key, query_log, servers_visited, negative_result)
+        run_walk(UPSTREAM_POOL, walk)
+        final_answer = walk.answer()
+        store_result(key, final_answer, walk.answer_ttl, negative_result)
+    finally:
+        finish_resolution(INFLIGHT, key, final_answer, negative_result, servers_visited)
+    return final_answer
+
+def record_resolution(final_answer, negative_result, servers_visited):
+    result = "success" if final_answer else "negative" if negative_result[0] else "failure"
+    METRICS.inc("dns_resolutions_total", (("result", result),))
+    METRICS.observe("dns_servers_visited", servers_visited[0])
+
+def refresh_entry(key):
+    query_log = []
+    try:
+        resolve_and_store(key, query_log, [0], [None])
+    except Exception as e:
+        print(f"[REFRESH_FAILURE] {e}")
+    finally:
+        write_query_log(query_log)
+
+def start_refresh(key):
+    leader, entry = INFLIGHT.join(key)
+    if leader:
+        threading.Thread(target=refresh_entry, args=(key,), daemon=True).start()
+    return entry
+
+def use_stale_or_refreshed(key, result, stale, query_log, lookup_start, negative_result):
+    if result and (result[0] or result[1]):
+        final_answer, negative_result[0] = result
+        log_shared_result(query_log, key, "Refreshed", lookup_start, final_answer, negative_result)
+        return final_answer
+
+    final_answer = answer_with_ttl(stale[0], lambda ttl: STALE_ANSWER_TTL)
+    log_shared_result(query_log, key, "Stale", lookup_start, final_answer, negative_result)
+    return final_answer
+
+def begin_query(data, query_log, negative_result, start_refresh):
+    lookup_start = time.time()
+    incoming_packet = Message(data)
+    key = cache_key(incoming_packet.qd.qname, incoming_packet.qd.qtype, incoming_packet.qd.qclass)
+    hit, final_answer = lookup_cached(key, query_log, lookup_start, negative_result, start_refresh)
+    stale = None if hit else ANSWER_CACHE.get_stale(key)
+    return incoming_packet, key, lookup_start, hit, final_answer, stale
 
 def dispatch_query(data, client_address, listen_socket):
     query_log = []
     servers_visited_count = [0]
-    query_socket = None
+    METRICS.inc("dns_queries_total")
+    METRICS.inc("dns_inflight_queries")
     
     try:
-        query_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        query_socket.settimeout(NETWORK_TIMEOUT)
-
-        incoming_packet = DNS(data)
-        domain_to_query = incoming_packet.qd[0].qname
-        packet_to_forward = DNS(qd=DNSQR(qname=domain_to_query))
-
-        final_ip_address = perform_iterative_resolution(query_socket, packet_to_forward, query_log, servers_visited_count)
+        negative_result = [None]
+        incoming_packet, key, lookup_start, hit, final_answer, stale = begin_query(data, query_log, negative_result, start_refresh)
+        if stale:
+            result = None if stale[2] else INFLIGHT.wait(start_refresh(key), STALE_CLIENT_TIMEOUT)
+            final_answer = use_stale_or_refreshed(key, result, stale, query_log, lookup_start, negative_result)
+        elif not hit:
+            leader, entry = INFLIGHT.join(key)
+            if leader:
+                final_answer = resolve_and_store(key, query_log, servers_visited_count, negative_result)
+            else:
+                final_answer, negative_result[0] = INFLIGHT.wait(entry, COALESCE_WAIT) or (None, None)
+                log_shared_result(query_log, key, "Coalesced", lookup_start, final_answer, negative_result)
 
-        if final_ip_address:
-            reply_packet = DNS(
-                id=incoming_packet.id, qr=1, aa=0, ra=1, rcode=0,
-                qd=incoming_packet.qd,
-                an=DNSRR(rrname=incoming_packet.qd.qname, type='A', ttl=60, rdata=final_ip_address)
-            )
-            listen_socket.sendto(raw(reply_packet), client_address)
-            print(f"[REPLY] {domain_to_query.decode()} -> {final_ip_address} (to {client_address[0]})")
+        send_reply(listen_socket, incoming_packet, client_address, final_answer, negative_result)
 
     except Exception as e:
         print(f"[WORKER_FAILURE] {e}")
 
     finally:
-        if query_socket:
-            query_socket.close()
+        METRICS.inc("dns_inflight_queries", n=-1)
+        write_query_log(query_log)
+
+def shed_query(data, client_address, transport, rcode):
+    try:
+        incoming_packet = Message(data)
+        key = cache_key(incoming_packet.qd.qname, incoming_packet.qd.qtype, incoming_packet.qd.qclass)
+        cached = ANSWER_CACHE.peek(key)
+        METRICS.inc("dns_queries_shed_total", (("result", "cached" if cached else RCODE_NAMES[rcode]),))
+        if cached:
+            send_reply(transport, incoming_packet, client_address, age_answer(cached[0], cached[1]), [None])
+            return
+        METRICS.inc("dns_responses_total", (("rcode", RCODE_NAMES[rcode]),))
+        transport.sendto(build_reply(incoming_packet, rcode), client_address)
+    except (DNSWireError, AttributeError, OSError):
+        pass
 
-        with LOG_MUTEX:
-            with open(LOG_FILE_NAME, 'a') as f:
-                if not query_log or "RESOLUTION_COMPLETE" not in query_log[-1]:
-                    query_log.append(f"[FINAL_STATE: FAILED]")
-                f.write("\n".join(query_log) + "\n\n")
+def admit(data, client_address, transport, work_queue):
+    verdict = RATE_LIMITER.check(client_address[0])
+    if verdict == ALLOW:
+        work_queue.submit(data, client_address, transport)
+        return
+    METRICS.inc("dns_queries_ratelimited_total", (("action", "truncate" if verdict == TRUNCATE else "drop"),))
+    if verdict == TRUNCATE:
+        try:
+            transport.sendto(build_response(Message(data), 0, tc=1), client_address)
+        except (DNSWireError, OSError):
+            pass
 
 def init_resolver():
+    global WORK_QUEUE
     main_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if REUSE_PORT:
+        main_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     main_socket.bind((RESOLVER_IP, RESOLVER_PORT))
+    WORK_QUEUE = WorkQueue(dispatch_query, shed_query, WORKER_LIMIT, QUEUE_DEPTH, QUEUE_MAX_AGE).start()
+    if TCP_LISTENER:
+        serve_tcp_clients(RESOLVER_IP, RESOLVER_PORT, WORK_QUEUE.submit, REUSE_PORT)
     print(f"Custom resolver active on {RESOLVER_IP}:{RESOLVER_PORT}")
 
     while True:
         try:
             payload, address = main_socket.recvfrom(4096)
-            worker = threading.Thread(
-                target=dispatch_query,
-                args=(payload, address, main_socket),
-                daemon=True
-            )
-            worker.start()
+            admit(payload, address, main_socket, WORK_QUEUE)
         except Exception as e:
             print(f'[LISTENER_FAILURE] {e}')
 
+def print_cache_stats(mode='thread'):
+    inflight, upstream, tcp_upstream = INFLIGHT, UPSTREAM_POOL, TCP_UPSTREAM
+    if mode == 'asyncio':
+        from d_async_resolver import ASYNC_INFLIGHT, ASYNC_UPSTREAM, ASYNC_TCP_UPSTREAM
+        inflight, upstream, tcp_upstream = ASYNC_INFLIGHT, ASYNC_UPSTREAM, ASYNC_TCP_UPSTREAM
+    print(f"[CACHE] {ANSWER_CACHE.stats()}")
+    print(f"[DELEGATION_CACHE] {DELEGATION_CACHE.stats()}")
+    print(f"[NEGATIVE_CACHE] {NEGATIVE_CACHE.stats()}")
+    print(f"[SERVER_SELECTOR] {SERVER_SELECTOR.stats()}")
+    print(f"[INFLIGHT] {inflight.stats()}")
+    print(f"[UPSTREAM] {upstream.stats()}")
+    print(f"[UPSTREAM_TCP] {tcp_upstream.stats()}")
+    print(f"[ADMISSION] {admission_stats()}")
+
+def save_cache_snapshot():
+    if not SNAPSHOT_PATH:
+        return
+    try:
+        with SNAPSHOT_LOCK:
+            size = save_snapshot(SNAPSHOT_PATH, ANSWER_CACHE, NEGATIVE_CACHE, DELEGATION_CACHE)
+        print(f"[SNAPSHOT] wrote {size} bytes to {SNAPSHOT_PATH}")
+    except (OSError, SnapshotError) as e:
+        print(f"[SNAPSHOT_FAILURE] {e}")
+
+def load_cache_snapshot():
+    try:
+        answers, negatives, zones = load_snapshot(SNAPSHOT_PATH, ANSWER_CACHE, NEGATIVE_CACHE, DELEGATION_CACHE)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        print(f"[SNAPSHOT_FAILURE] {e}")
+        return
+    print(f"[SNAPSHOT] restored {answers} answers, {negatives} negative answers and {zones} delegations from {SNAPSHOT_PATH}")
+
+def snapshot_loop(interval):
+    while True:
+        time.sleep(interval)
+        save_cache_snapshot()
+
+def start_snapshots(interval):
+    load_cache_snapshot()
+    signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(target=save_cache_snapshot, daemon=True).start())
+    if interval > 0:
+        threading.Thread(target=snapshot_loop, args=(interval,), daemon=True).start()
+
+@METRICS.collector
+def collect_state():
+    cache = ANSWER_CACHE.stats()
+    yield "dns_cache_hit_ratio", (), cache["hit_ratio"]
+    yield "dns_cache_hits_total", (("result", "hit"),), cache["hits"]
+    yield "dns_cache_hits_total", (("result", "stale"),), cache["stale_hits"]
+    yield "dns_cache_hits_total", (("result", "miss"),), cache["misses"]
+    yield "dns_cache_entries", (("cache", "answer"),), cache["entries"]
+    yield "dns_cache_entries", (("cache", "negative"),), NEGATIVE_CACHE.stats()["entries"]
+    yield "dns_cache_entries", (("cache", "delegation"),), DELEGATION_CACHE.stats()["zones"]
+    with SERVER_SELECTOR.lock:
+        timeouts = dict(SERVER_SELECTOR.timeouts)
+        srtts = {ip: entry[0] for ip, entry in SERVER_SELECTOR.servers.items()}
+    for ip, count in timeouts.items():
+        yield "dns_upstream_timeouts_total", (("server", ip),), count
+    for ip, srtt in srtts.items():
+        yield "dns_upstream_srtt_seconds", (("server", ip),), round(srtt, 6)
+    yield "dns_coalesced_inflight", (), INFLIGHT.stats()["in_flight"]
+    yield "dns_threads", (), threading.active_count()
+    yield from collect_upstream(UPSTREAM_POOL, TCP_UPSTREAM)
+
+def admission_stats():
+    stats = RATE_LIMITER.stats()
+    if WORK_QUEUE is not None:
+        stats.update(WORK_QUEUE.stats())
+    return stats
+
+@METRICS.collector
+def collect_admission():
+    if WORK_QUEUE is not None:
+        yield "dns_queue_depth", (), WORK_QUEUE.stats()["depth"]
+
+def collect_upstream(pool, tcp_pool):
+    upstream = pool.stats()
+    yield "dns_upstream_replies_total", (("result", "accepted"),), upstream["accepted"]
+    yield "dns_upstream_replies_total", (("result", "rejected"),), upstream["rejected"]
+    yield "dns_upstream_pending", (), upstream["pending"]
+    tcp = tcp_pool.stats()
+    yield "dns_upstream_tcp_queries_total", (("result", "answered"),), tcp["queries"] - tcp["failures"]
+    yield "dns_upstream_tcp_queries_total", (("result", "failed"),), tcp["failures"]
+    yield "dns_upstream_tcp_connections", (), tcp["connections"]
+
+def main():
+    global LOG_LEVEL, LOG_FILE_NAME, ROOT_SERVER_IP, RESOLVER_IP, RESOLVER_PORT, UPSTREAM_PORT, TCP_LISTENER
+    global WORKER_LIMIT, QUEUE_DEPTH, QUEUE_MAX_AGE, RATE_LIMITER
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['thread', 'asyncio'], default='thread')
+    parser.add_argument('--log-format', choices=LOG_FORMATS, default='text')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='hop')
+    parser.add_argument('--log-file', default=LOG_FILE_NAME)
+    parser.add_argument('--metrics-port', type=int, default=0, help="serve Prometheus metrics on this port (0 = off)")
+    parser.add_argument('--metrics-host', default=METRICS_HOST)
+    parser.add_argument('--root', default=ROOT_SERVER_IP, help="root server to start iteration from")
+    parser.add_argument('--address', default=RESOLVER_IP)
+    parser.add_argument('--port', type=int, default=RESOLVER_PORT)
+    parser.add_argument('--upstream-port', type=int, default=UPSTREAM_PORT)
+    parser.add_argument('--no-tcp', action='store_true', help="answer clients over UDP only")
+    parser.add_argument('--concurrency', type=int, default=WORKER_LIMIT, help="queries resolved at once per process")
+    parser.add_argument('--queue-depth', type=int, default=QUEUE_DEPTH, help="queued queries before new ones are REFUSED")
+    parser.add_argument('--queue-max-age', type=float, default=QUEUE_MAX_AGE, help="seconds a query may wait before it is answered SERVFAIL")
+    parser.add_argument('--client-rate', type=float, default=CLIENT_RATE, help="queries per second allowed per client IP over UDP (0 = unlimited)")
+    parser.add_argument('--client-burst', type=float, default=CLIENT_BURST, help="token bucket size per client (default: twice the rate)")
+    parser.add_argument('--snapshot', help="cache snapshot file, loaded at startup and written periodically, on SIGUSR1 and on exit")
+    parser.add_argument('--snapshot-interval', type=float, default=SNAPSHOT_INTERVAL)
+    parser.add_argument('--workers', type=int, default=1, help="worker processes sharing the port via SO_REUSEPORT")
+    args = parser.parse_args()
+
+    ROOT_SERVER_IP = args.root
+    RESOLVER_IP, RESOLVER_PORT = args.address, args.port
+    UPSTREAM_PORT = args.upstream_port
+    TCP_LISTENER = not args.no_tcp
+    WORKER_LIMIT, QUEUE_DEPTH, QUEUE_MAX_AGE = args.concurrency, args.queue_depth, args.queue_max_age
+    RATE_LIMITER = RateLimiter(args.client_rate, args.client_burst)
+    LOG_LEVEL = args.log_level
+    LOG_FILE_NAME = args.log_file
+
+    if args.workers > 1:
+        from d_workers import supervise
+        supervise(args.workers, serve, args)
+    else:
+        serve(args)
+
+def serve(args, worker_index=None):
+    global REUSE_PORT, SNAPSHOT_PATH
+    REUSE_PORT = worker_index is not None
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if args.snapshot:
+        SNAPSHOT_PATH = args.snapshot if worker_index is None else f"{args.snapshot}.{worker_index}"
+        start_snapshots(args.snapshot_interval)
+    LOG_WRITER.start(LOG_FILE_NAME, args.log_format)
+    if args.metrics_port:
+        metrics_port = args.metrics_port + (worker_index or 0)
+        METRICS.serve(args.metrics_host, metrics_port)
+        print(f"Metrics on http://{args.metrics_host}:{metrics_port}/metrics")
+
+    try:
+        if args.mode == 'asyncio':
+            from d_async_resolver import init_async_resolver
+            asyncio.run(init_async_resolver())
+        else:
+            init_resolver()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print_cache_stats(args.mode)
+        save_cache_snapshot()
+        LOG_WRITER.close()
+
 if __name__ == "__main__":
-    init_resolver()
\ No newline at end of file
+    # Helper modules import d_resolver by name, so run from that copy to share its caches
+    import d_resolver
+    d_resolver.main()
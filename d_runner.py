@@ -1,16 +1,23 @@
 import subprocess
 import re
-import sys
 import time
+import argparse
+import asyncio
+import os
 import threading
 from queue import Queue
 
+from d_loadgen import run_load
+from latency_hist import LatencyHistogram, merge_histograms, write_results
+
 WORKER_THREADS = 30
 PROCESS_TIMEOUT = 41
 DIG_TRIES = "1"
 DIG_WAIT = "40"
+RESOLVER_IP = "10.0.0.5"
+UDP_TIMEOUT = 5.0
 
-def dig_probe(domain_queue, stats_lock, latencies, successful_queries, resolution_counts):
+def dig_probe(domain_queue, stats_lock, histogram, successful_queries, resolution_counts):
     while True:
         domain, index = domain_queue.get()
         try:
@@ -19,12 +26,14 @@ def dig_probe(domain_queue, stats_lock, latencies, successful_queries, resolutio
             
             answer_match = re.search(r'ANSWER SECTION:\n([\w\.-]+)\.\s+\d+\s+IN\s+A\s+([\d\.]+)', proc_output.stdout, re.IGNORECASE)
 
+            if answer_match:
+                time_match = re.search(r'Query time: (\d+) msec', proc_output.stdout)
+                if time_match:
+                    histogram.record(int(time_match.group(1)) * 1000)
+
             with stats_lock:
                 if answer_match:
                     resolution_counts["successful"] += 1
-                    time_match = re.search(r'Query time: (\d+) msec', proc_output.stdout)
-                    if time_match:
-                        latencies.append(int(time_match.group(1)))
                     successful_queries.append(domain)
                     print(f"[RESOLVED] {domain:<30} (Job {index})")
                 else:
@@ -38,7 +47,10 @@ def dig_probe(domain_queue, stats_lock, latencies, successful_queries, resolutio
         finally:
             domain_queue.task_done()
 
-def execute_benchmark(domain_list_file):
+def default_results_path(domain_list_file):
+    return os.path.splitext(os.path.basename(domain_list_file))[0] + "_bench.json"
+
+def execute_benchmark(domain_list_file, results_path=None):
     run_start = time.monotonic()
 
     with open(domain_list_file, 'r') as f:
@@ -47,7 +59,7 @@ def execute_benchmark(domain_list_file):
     domain_queue = Queue()
     total_queries = len(domains)
 
-    latencies = []
+    histograms = [LatencyHistogram() for _ in range(WORKER_THREADS)]
     resolution_counts = {"successful": 0, "failed": 0}
     successful_queries = []
     stats_lock = threading.Lock()
@@ -55,10 +67,10 @@ def execute_benchmark(domain_list_file):
 
     print(f"Starting {total_queries} queries with {WORKER_THREADS} workers:")
 
-    for _ in range(WORKER_THREADS):
+    for i in range(WORKER_THREADS):
         t = threading.Thread(
             target=dig_probe,
-            args=(domain_queue, stats_lock, latencies, successful_queries, resolution_counts),
+            args=(domain_queue, stats_lock, histograms[i], successful_queries, resolution_counts),
             daemon=True
         )
         workers.append(t)
@@ -74,15 +86,70 @@ def execute_benchmark(domain_list_file):
 
     ok_count = resolution_counts["successful"]
     fail_count = resolution_counts["failed"]
-    avg_latency = sum(latencies) / len(latencies) if latencies else 0
+    histogram = merge_histograms(histograms)
+    avg_latency = histogram.mean() / 1000
     throughput = total_queries / total_duration if total_duration > 0 else 0
 
     print(f"\nTotal Queries Attempted: {total_queries}")
     print(f"Number of successfully resolved queries: {ok_count}")
     print(f"Number of failed resolutions: {fail_count}")
     print(f"Average lookup latency: {avg_latency:.2f} ms")
+    print(f"Latency percentiles: {histogram.format_summary()}")
     print(f"Average throughput: {throughput:.2f} queries/sec")
     print(f"Total Test Duration: {total_duration:.2f} s")
 
+    results = {
+        "engine": "dig", "domain_list": domain_list_file, "total": total_queries,
+        "successful": ok_count, "failed": fail_count,
+        "duration_s": total_duration, "achieved_qps": throughput,
+    }
+    results_path = results_path or default_results_path(domain_list_file)
+    write_results(results_path, results, histogram)
+    print(f"Results written to {results_path}")
+    return results
+
+def execute_udp_benchmark(domain_list_file, server, qps=None, concurrency=WORKER_THREADS, count=None, timeout=UDP_TIMEOUT, results_path=None, sockets=1, port=53):
+    with open(domain_list_file, 'r') as f:
+        domains = [line.strip() for line in f if line.strip()]
+
+    mode = f"open-loop at {qps} QPS" if qps else f"closed-loop with {concurrency} outstanding"
+    print(f"Starting {count or len(domains)} queries against {server} ({mode}):")
+
+    generator, total_duration = asyncio.run(run_load(server, domains, port=port, qps=qps, concurrency=concurrency, timeout=timeout, count=count, sockets=sockets))
+    results = generator.results(total_duration)
+
+    print(f"\nTotal Queries Attempted: {results['total']}")
+    print(f"Number of successfully resolved queries: {results['successful']}")
+    print(f"Number of failed resolutions: {results['failed']} (timeouts: {results['timeouts']}, truncated: {results['truncated']}, dropped: {results['dropped']})")
+    print(f"Response codes: {results['rcodes']}")
+    print(f"Average lookup latency: {results['avg_latency_ms']:.3f} ms")
+    print(f"Latency percentiles: {generator.histogram.format_summary()}")
+    if qps:
+        print(f"Target rate: {qps:.2f} queries/sec")
+    print(f"Average throughput: {results['achieved_qps']:.2f} queries/sec")
+    print(f"Total Test Duration: {total_duration:.2f} s")
+
+    results.update({"engine": "udp", "domain_list": domain_list_file, "server": server, "target_qps": qps, "concurrency": None if qps else concurrency})
+    results_path = results_path or default_results_path(domain_list_file)
+    write_results(results_path, results, generator.histogram)
+    print(f"Results written to {results_path}")
+    return results
+
 if __name__ == "__main__":
-    execute_benchmark(sys.argv[1])
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('domain_list_file')
+    parser.add_argument('--engine', choices=['dig', 'udp'], default='dig')
+    parser.add_argument('--server', default=RESOLVER_IP)
+    parser.add_argument('--port', type=int, default=53)
+    parser.add_argument('--qps', type=float, help="open-loop: send at a fixed rate")
+    parser.add_argument('--concurrency', type=int, default=WORKER_THREADS, help="closed-loop: queries kept outstanding")
+    parser.add_argument('--count', type=int, help="total queries, cycling through the domain list")
+    parser.add_argument('--timeout', type=float, default=UDP_TIMEOUT)
+    parser.add_argument('--sockets', type=int, default=1, help="source sockets to spread queries over (lets SO_REUSEPORT balance workers)")
+    parser.add_argument('--results', help="results file (.json or .csv), default <list>_bench.json")
+    args = parser.parse_args()
+
+    if args.engine == 'udp':
+        execute_udp_benchmark(args.domain_list_file, args.server, args.qps, args.concurrency, args.count, args.timeout, args.results, args.sockets, args.port)
+    else:
+        execute_benchmark(args.domain_list_file, args.results)
\ No newline at end of file
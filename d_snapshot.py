@@ -0,0 +1,140 @@
+import mmap
+import os
+import struct
+import time
+
+from d_wire import Message, Record, encode_message, TYPE_SOA
+
+MAGIC = b'DNSSNAP3'
+HEADER = struct.Struct('!8sdIII')
+ANSWER_FIXED = struct.Struct('!HHdd')
+SOA_FIXED = struct.Struct('!BIIIIII')
+REMAINING = struct.Struct('!d')
+BLOB_LENGTH = struct.Struct('!H')
+SNAPSHOT_INTERVAL = 300
+
+class SnapshotError(ValueError):
+    pass
+
+def pack_str(buf, value):
+    data = value.encode()
+    if len(data) > 255:
+        raise SnapshotError(f"string too long: {value[:32]}...")
+    buf.append(len(data))
+    buf += data
+
+def unpack_str(data, offset):
+    length = data[offset]
+    end = offset + 1 + length
+    if end > len(data):
+        raise SnapshotError("truncated snapshot")
+    return data[offset + 1:end].decode(), end
+
+def pack_answer(buf, records):
+    data = encode_message(0, 0x8000, answers=records)
+    buf += BLOB_LENGTH.pack(len(data))
+    buf += data
+
+def unpack_answer(data, offset):
+    end = offset + BLOB_LENGTH.size + BLOB_LENGTH.unpack_from(data, offset)[0]
+    if end > len(data):
+        raise SnapshotError("truncated snapshot")
+    return tuple(Message(data[offset + BLOB_LENGTH.size:end]).an), end
+
+def pack_key(buf, key, remaining, ttl):
+    pack_str(buf, key[0])
+    buf += ANSWER_FIXED.pack(key[1], key[2], remaining, ttl)
+
+def unpack_key(data, offset):
+    qname, offset = unpack_str(data, offset)
+    qtype, qclass, remaining, ttl = ANSWER_FIXED.unpack_from(data, offset)
+    return (qname, qtype, qclass), remaining, ttl, offset + ANSWER_FIXED.size
+
+def encode_snapshot(answers, negatives, delegations):
+    buf = bytearray(HEADER.pack(MAGIC, time.time(), len(answers), len(negatives), len(delegations)))
+    for key, value, remaining, ttl in answers:
+        pack_key(buf, key, remaining, ttl)
+        pack_answer(buf, value)
+    for key, (rcode, soa, chain), remaining, ttl in negatives:
+        pack_key(buf, key, remaining, ttl)
+        pack_str(buf, soa.rrname)
+        pack_str(buf, soa.rdata[0])
+        pack_str(buf, soa.rdata[1])
+        buf += SOA_FIXED.pack(rcode, int(soa.ttl), *soa.rdata[2:7])
+        pack_answer(buf, chain)
+    for zone, ns_names, ips, remaining in delegations:
+        pack_str(buf, zone)
+        buf += REMAINING.pack(remaining)
+        for names in (ns_names[:255], ips[:255]):
+            buf.append(len(names))
+            for name in names:
+                pack_str(buf, name)
+    return bytes(buf)
+
+def decode_snapshot(data):
+    if len(data) < HEADER.size:
+        raise SnapshotError("snapshot shorter than header")
+    magic, saved_at, answer_count, negative_count, delegation_count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError("not a cache snapshot")
+    elapsed = max(0.0, time.time() - saved_at)
+    offset = HEADER.size
+    answers, negatives, delegations = [], [], []
+
+    for _ in range(answer_count):
+        key, remaining, ttl, offset = unpack_key(data, offset)
+        value, offset = unpack_answer(data, offset)
+        answers.append((key, value, remaining - elapsed, ttl))
+
+    for _ in range(negative_count):
+        key, remaining, ttl, offset = unpack_key(data, offset)
+        owner, offset = unpack_str(data, offset)
+        mname, offset = unpack_str(data, offset)
+        rname, offset = unpack_str(data, offset)
+        rcode, soa_ttl, *fields = SOA_FIXED.unpack_from(data, offset)
+        offset += SOA_FIXED.size
+        chain, offset = unpack_answer(data, offset)
+        negatives.append((key, (rcode, Record(owner, TYPE_SOA, soa_ttl, (mname, rname, *fields)), chain), remaining - elapsed, ttl))
+
+    for _ in range(delegation_count):
+        zone, offset = unpack_str(data, offset)
+        remaining = REMAINING.unpack_from(data, offset)[0]
+        offset += REMAINING.size
+        lists = []
+        for _ in range(2):
+            count = data[offset]
+            offset += 1
+            names = []
+            for _ in range(count):
+                name, offset = unpack_str(data, offset)
+                names.append(name)
+            lists.append(names)
+        delegations.append((zone, lists[0], lists[1], remaining - elapsed))
+
+    return answers, negatives, delegations
+
+def save_snapshot(path, answer_cache, negative_cache, delegation_cache):
+    data = encode_snapshot(answer_cache.export(), negative_cache.export(), delegation_cache.export())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+def load_snapshot(path, answer_cache, negative_cache, delegation_cache):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        try:
+            answers, negatives, delegations = decode_snapshot(mm)
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise SnapshotError(f"corrupt snapshot: {e}")
+
+    for key, value, remaining, ttl in answers:
+        answer_cache.restore(key, value, remaining, ttl)
+    for key, value, remaining, ttl in negatives:
+        negative_cache.restore(key, value, remaining, ttl)
+    restored = 0
+    for zone, ns_names, ips, remaining in delegations:
+        if remaining > 0:
+            delegation_cache.put(zone, ns_names, ips, remaining)
+            restored += 1
+    return len(answers), len(negatives), restored
@@ -0,0 +1,64 @@
+import random
+import threading
+
+SRTT_ALPHA = 0.3
+RTTVAR_BETA = 0.25
+UNSELECTED_DECAY = 0.98
+TIMEOUT_BACKOFF = 2.0
+UNKNOWN_SRTT_MAX = 0.032
+UNKNOWN_RTO = 0.4
+MIN_RTO = 0.05
+MAX_SRTT = 10.0
+
+class ServerSelector:
+    def __init__(self, max_rto=5.0):
+        self.max_rto = max_rto
+        self.servers = {}
+        self.lock = threading.Lock()
+        self.timeouts = {}
+
+    def order(self, ips):
+        ips = [str(ip) for ip in dict.fromkeys(ips)]
+        with self.lock:
+            ranked = sorted(ips, key=lambda ip: self.servers[ip][0] if ip in self.servers else random.uniform(0, UNKNOWN_SRTT_MAX))
+            for ip in ranked[1:]:
+                entry = self.servers.get(ip)
+                if entry:
+                    entry[0] *= UNSELECTED_DECAY
+        return ranked
+
+    def timeout(self, ip):
+        with self.lock:
+            entry = self.servers.get(str(ip))
+            if entry is None:
+                return UNKNOWN_RTO
+            return max(MIN_RTO, min(entry[0] + 4 * entry[1], self.max_rto))
+
+    def record_rtt(self, ip, rtt):
+        ip = str(ip)
+        with self.lock:
+            entry = self.servers.get(ip)
+            if entry is None:
+                self.servers[ip] = [rtt, rtt / 2]
+                return
+            srtt, rttvar = entry
+            entry[1] = (1 - RTTVAR_BETA) * rttvar + RTTVAR_BETA * abs(srtt - rtt)
+            entry[0] = (1 - SRTT_ALPHA) * srtt + SRTT_ALPHA * rtt
+
+    def record_timeout(self, ip):
+        ip = str(ip)
+        with self.lock:
+            self.timeouts[ip] = self.timeouts.get(ip, 0) + 1
+            entry = self.servers.get(ip)
+            if entry is None:
+                self.servers[ip] = [UNKNOWN_RTO * TIMEOUT_BACKOFF, UNKNOWN_RTO]
+                return
+            entry[0] = min(entry[0] * TIMEOUT_BACKOFF + MIN_RTO, MAX_SRTT)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "servers": len(self.servers),
+                "timeouts": sum(self.timeouts.values()),
+                "slowest": sorted(((round(v[0], 4), ip) for ip, v in self.servers.items()), reverse=True)[:5],
+            }
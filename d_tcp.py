@@ -0,0 +1,371 @@
+import asyncio
+import queue
+import socket
+import struct
+import threading
+
+from d_wire import DNSWireError, Message
+
+LENGTH = struct.Struct('!H')
+CONNECT_TIMEOUT = 2
+UPSTREAM_IDLE_TIMEOUT = 10
+CLIENT_IDLE_TIMEOUT = 30
+LISTEN_BACKLOG = 128
+
+def frame(data):
+    return LENGTH.pack(len(data)) + bytes(data)
+
+def recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        try:
+            chunk = sock.recv(n - len(buf))
+        except socket.timeout:
+            if buf:
+                raise ConnectionError("timed out inside a frame")
+            raise
+        if not chunk:
+            raise ConnectionError("connection closed")
+        buf += chunk
+    return bytes(buf)
+
+def recv_frame(sock):
+    length = LENGTH.unpack(recv_exact(sock, LENGTH.size))[0]
+    try:
+        return recv_exact(sock, length)
+    except socket.timeout:
+        raise ConnectionError("timed out inside a frame")
+
+def message_key(message):
+    question = message.qd
+    if question is None:
+        raise DNSWireError("no question")
+    return message.id, question.qname.lower(), question.qtype
+
+class TcpConnection:
+    def __init__(self, pool, addr):
+        self.pool = pool
+        self.addr = addr
+        self.sock = socket.create_connection(addr, timeout=CONNECT_TIMEOUT)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(UPSTREAM_IDLE_TIMEOUT)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.closed = False
+        threading.Thread(target=self.read_loop, daemon=True).start()
+
+    def query(self, data, key, timeout):
+        replies = queue.SimpleQueue()
+        with self.lock:
+            if self.closed:
+                raise ConnectionError("connection closed")
+            self.pending[key] = replies
+            try:
+                self.sock.sendall(frame(data))
+            except OSError:
+                self.pending.pop(key, None)
+                raise
+        try:
+            reply = replies.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def read_loop(self):
+        try:
+            while True:
+                try:
+                    data = recv_frame(self.sock)
+                except socket.timeout:
+                    with self.lock:
+                        if not self.pending:
+                            break
+                    continue
+                try:
+                    response = Message(data)
+                    key = message_key(response)
+                except DNSWireError:
+                    continue
+                with self.lock:
+                    replies = self.pending.pop(key, None)
+                if replies is not None and response.qr:
+                    replies.put(response)
+        except OSError:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        self.sock.close()
+        for replies in pending.values():
+            replies.put(ConnectionError("connection closed"))
+        self.pool.discard(self)
+
+class TcpUpstreamPool:
+    def __init__(self):
+        self.connections = {}
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.queries = 0
+        self.failures = 0
+
+    def connection(self, addr):
+        with self.lock:
+            conn = self.connections.get(addr)
+        if conn is None or conn.closed:
+            conn = TcpConnection(self, addr)
+            with self.lock:
+                self.connections[addr] = conn
+                self.opened += 1
+        return conn
+
+    def query(self, ip, port, data, timeout):
+        key = message_key(Message(data))
+        self.queries += 1
+        for attempt in range(2):
+            try:
+                return self.connection((ip, port)).query(data, key, timeout)
+            except OSError:
+                pass
+        self.failures += 1
+        return None
+
+    def discard(self, conn):
+        with self.lock:
+            if self.connections.get(conn.addr) is conn:
+                del self.connections[conn.addr]
+
+    def stats(self):
+        with self.lock:
+            return {"connections": len(self.connections), "opened": self.opened, "queries": self.queries, "failures": self.failures}
+
+class AsyncTcpConnection:
+    def __init__(self, pool, addr, reader, writer):
+        self.pool = pool
+        self.addr = addr
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}
+        self.closed = False
+        self.task = asyncio.ensure_future(self.read_loop())
+
+    async def query(self, data, key, timeout):
+        if self.closed:
+            raise ConnectionError("connection closed")
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        self.writer.write(frame(data))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.pending.pop(key, None)
+
+    async def read_loop(self):
+        try:
+            while True:
+                try:
+                    header = await asyncio.wait_for(self.reader.readexactly(LENGTH.size), UPSTREAM_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if not self.pending:
+                        break
+                    continue
+                data = await asyncio.wait_for(self.reader.readexactly(LENGTH.unpack(header)[0]), UPSTREAM_IDLE_TIMEOUT)
+                try:
+                    response = Message(data)
+                    key = message_key(response)
+                except DNSWireError:
+                    continue
+                future = self.pending.pop(key, None)
+                if future is not None and response.qr and not future.done():
+                    future.set_result(response)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.close()
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("connection closed"))
+        self.pool.discard(self)
+
+class AsyncTcpUpstreamPool:
+    def __init__(self):
+        self.connections = {}
+        self.opened = 0
+        self.queries = 0
+        self.failures = 0
+
+    async def connection(self, addr):
+        task = self.connections.get(addr)
+        if task is None or (task.done() and (task.cancelled() or task.exception() or task.result().closed)):
+            task = self.connections[addr] = asyncio.ensure_future(self.open(addr))
+        return await asyncio.shield(task)
+
+    async def open(self, addr):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*addr), CONNECT_TIMEOUT)
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.opened += 1
+        return AsyncTcpConnection(self, addr, reader, writer)
+
+    async def query(self, ip, port, data, timeout):
+        key = message_key(Message(data))
+        self.queries += 1
+        for attempt in range(2):
+            try:
+                conn = await self.connection((ip, port))
+                return await conn.query(data, key, timeout)
+            except (OSError, asyncio.TimeoutError):
+                pass
+        self.failures += 1
+        return None
+
+    def discard(self, conn):
+        task = self.connections.get(conn.addr)
+        if task is not None and task.done() and not task.cancelled() and not task.exception() and task.result() is conn:
+            del self.connections[conn.addr]
+
+    def stats(self):
+        live = sum(1 for task in self.connections.values() if task.done() and not task.cancelled() and not task.exception())
+        return {"connections": live, "opened": self.opened, "queries": self.queries, "failures": self.failures}
+
+    def close(self):
+        for task in list(self.connections.values()):
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and not task.exception():
+                task.result().close()
+        self.connections = {}
+
+class TcpReplyChannel:
+    max_message_size = 65535
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.cond = threading.Condition()
+        self.pending = 0
+
+    def expect(self):
+        with self.cond:
+            self.pending += 1
+
+    def sendto(self, data, addr):
+        with self.cond:
+            try:
+                self.sock.sendall(frame(data))
+            finally:
+                self.pending -= 1
+                self.cond.notify_all()
+
+    def drain(self, timeout):
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending, timeout)
+
+def serve_tcp_clients(address, port, submit, reuse_port=False):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listener.bind((address, port))
+    listener.listen(LISTEN_BACKLOG)
+    threading.Thread(target=accept_loop, args=(listener, submit), daemon=True).start()
+    return listener
+
+def accept_loop(listener, submit):
+    while True:
+        try:
+            conn, addr = listener.accept()
+        except OSError as e:
+            if listener.fileno() == -1:
+                return
+            print(f'[LISTENER_FAILURE] {e}')
+            continue
+        threading.Thread(target=client_loop, args=(conn, addr, submit), daemon=True).start()
+
+def client_loop(conn, addr, submit):
+    conn.settimeout(CLIENT_IDLE_TIMEOUT)
+    channel = TcpReplyChannel(conn)
+    with conn:
+        while True:
+            try:
+                data = recv_frame(conn)
+            except socket.timeout:
+                if channel.pending and channel.drain(CLIENT_IDLE_TIMEOUT):
+                    continue
+                break
+            except OSError:
+                break
+            channel.expect()
+            submit(data, addr, channel)
+        channel.drain(CLIENT_IDLE_TIMEOUT)
+
+class AsyncTcpReplyChannel:
+    max_message_size = 65535
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.pending = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def expect(self):
+        self.pending += 1
+        self.idle.clear()
+
+    def sendto(self, data, addr):
+        self.pending -= 1
+        if not self.pending:
+            self.idle.set()
+        if not self.writer.is_closing():
+            self.writer.write(frame(data))
+
+    async def drain(self, timeout):
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+def async_client_handler(submit):
+    async def handle(reader, writer):
+        channel = AsyncTcpReplyChannel(writer)
+        addr = writer.get_extra_info('peername')
+        try:
+            while True:
+                try:
+                    header = await asyncio.wait_for(reader.readexactly(LENGTH.size), CLIENT_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if channel.pending and await channel.drain(CLIENT_IDLE_TIMEOUT):
+                        continue
+                    break
+                data = await asyncio.wait_for(reader.readexactly(LENGTH.unpack(header)[0]), CLIENT_IDLE_TIMEOUT)
+                channel.expect()
+                submit(data, addr, channel)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            await channel.drain(CLIENT_IDLE_TIMEOUT)
+            writer.close()
+    return handle
+
+async def start_async_tcp_clients(address, port, submit, reuse_port=None):
+    return await asyncio.start_server(
+        async_client_handler(submit), address, port, reuse_port=reuse_port, backlog=LISTEN_BACKLOG
+    )
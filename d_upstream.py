@@ -0,0 +1,186 @@
+import asyncio
+import queue
+import random
+import secrets
+import selectors
+import socket
+import threading
+import time
+
+from d_wire import DNSWireError, Message, add_edns, EDNS_UDP_SIZE
+
+POOL_SIZE = 8
+RECV_SIZE = 65535
+
+class Exchange:
+    __slots__ = ('txid', 'data', 'qname', 'qtype', 'sock', 'sent', 'keys', 'replies')
+
+    def __init__(self, txid, packet, sock, replies, edns_size=EDNS_UDP_SIZE):
+        question = packet.qd
+        self.txid = txid
+        self.data = txid.to_bytes(2, 'big') + bytes(packet.data[2:])
+        if edns_size:
+            self.data = add_edns(self.data, edns_size)
+        self.qname = question.qname.lower()
+        self.qtype = question.qtype
+        self.sock = sock
+        self.sent = {}
+        self.keys = []
+        self.replies = replies
+
+class UpstreamDemux:
+    def __init__(self, size=POOL_SIZE, edns_size=EDNS_UDP_SIZE):
+        self.size = size
+        self.edns_size = edns_size
+        self.pending = {}
+        self.txids = set()
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+
+    def new_txid(self):
+        while True:
+            txid = secrets.randbits(16)
+            if txid not in self.txids:
+                self.txids.add(txid)
+                return txid
+
+    def register(self, exchange, addr):
+        key = (exchange.txid, addr, exchange.qname, exchange.qtype)
+        with self.lock:
+            self.pending[key] = exchange
+        exchange.keys.append(key)
+        exchange.sent[addr[0]] = time.time()
+
+    def finish(self, exchange):
+        with self.lock:
+            for key in exchange.keys:
+                self.pending.pop(key, None)
+            self.txids.discard(exchange.txid)
+
+    def match(self, data, addr):
+        try:
+            response = Message(data)
+            question = response.qd
+            if not response.qr or question is None:
+                raise DNSWireError("not a response")
+            key = (response.id, addr, question.qname.lower(), question.qtype)
+        except DNSWireError:
+            self.rejected += 1
+            return None, None
+
+        with self.lock:
+            exchange = self.pending.get(key)
+        if exchange is None:
+            self.rejected += 1
+            return None, None
+        self.accepted += 1
+        return exchange, response
+
+    def stats(self):
+        with self.lock:
+            return {"sockets": self.size, "pending": len(self.pending), "accepted": self.accepted, "rejected": self.rejected}
+
+class UpstreamPool(UpstreamDemux):
+    def __init__(self, size=POOL_SIZE, edns_size=EDNS_UDP_SIZE):
+        super().__init__(size, edns_size)
+        self.sockets = []
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            selector = selectors.DefaultSelector()
+            for _ in range(self.size):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind(('0.0.0.0', 0))
+                sock.setblocking(False)
+                selector.register(sock, selectors.EVENT_READ)
+                self.sockets.append(sock)
+            self.thread = threading.Thread(target=self.run, args=(selector,), daemon=True)
+            self.thread.start()
+
+    def run(self, selector):
+        while True:
+            for key, _ in selector.select():
+                while True:
+                    try:
+                        data, addr = key.fileobj.recvfrom(RECV_SIZE)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError:
+                        break
+                    received = time.time()
+                    exchange, response = self.match(data, addr)
+                    if exchange is not None:
+                        exchange.replies.put((addr[0], response, received))
+
+    def exchange(self, packet):
+        if self.thread is None:
+            self.start()
+        with self.lock:
+            txid = self.new_txid()
+        return Exchange(txid, packet, random.choice(self.sockets), queue.SimpleQueue(), self.edns_size)
+
+    def send(self, exchange, ip, port):
+        self.register(exchange, (ip, port))
+        exchange.sock.sendto(exchange.data, (ip, port))
+
+    def wait(self, exchange, timeout):
+        try:
+            return exchange.replies.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class PooledProtocol(asyncio.DatagramProtocol):
+    def __init__(self, pool):
+        self.pool = pool
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        exchange, response = self.pool.match(data, addr)
+        if exchange is not None and not exchange.replies.done():
+            exchange.replies.set_result((addr[0], response, time.time()))
+
+    def error_received(self, exc):
+        pass
+
+class AsyncUpstreamPool(UpstreamDemux):
+    def __init__(self, size=POOL_SIZE, edns_size=EDNS_UDP_SIZE):
+        super().__init__(size, edns_size)
+        self.transports = []
+        self.starting = None
+
+    async def start(self):
+        if self.starting is None:
+            self.starting = asyncio.ensure_future(self.open_transports())
+        await asyncio.shield(self.starting)
+
+    async def open_transports(self):
+        loop = asyncio.get_running_loop()
+        for _ in range(self.size):
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: PooledProtocol(self), local_addr=('0.0.0.0', 0), family=socket.AF_INET
+            )
+            self.transports.append(transport)
+
+    async def exchange(self, packet):
+        if len(self.transports) < self.size:
+            await self.start()
+        with self.lock:
+            txid = self.new_txid()
+        return Exchange(txid, packet, random.choice(self.transports), asyncio.get_running_loop().create_future(), self.edns_size)
+
+    def send(self, exchange, ip, port):
+        self.register(exchange, (ip, port))
+        exchange.sock.sendto(exchange.data, (ip, port))
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+        self.starting = None
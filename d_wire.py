@@ -0,0 +1,292 @@
+import socket
+import struct
+
+TYPE_A = 1
+TYPE_NS = 2
+TYPE_CNAME = 5
+TYPE_SOA = 6
+TYPE_PTR = 12
+TYPE_MX = 15
+TYPE_TXT = 16
+TYPE_AAAA = 28
+TYPE_OPT = 41
+
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+RCODE_REFUSED = 5
+RCODE_NAMES = {RCODE_NOERROR: 'NOERROR', RCODE_SERVFAIL: 'SERVFAIL', RCODE_NXDOMAIN: 'NXDOMAIN', RCODE_REFUSED: 'REFUSED'}
+
+HEADER = struct.Struct('!HHHHHH')
+RR_FIXED = struct.Struct('!HHIH')
+QUESTION_FIXED = struct.Struct('!HH')
+SOA_FIXED = struct.Struct('!IIIII')
+NAME_TYPES = (TYPE_NS, TYPE_CNAME, TYPE_PTR)
+MX_FIXED = struct.Struct('!H')
+MAX_POINTER_JUMPS = 32
+CLASSIC_UDP_SIZE = 512
+EDNS_UDP_SIZE = 1232
+
+class DNSWireError(ValueError):
+    pass
+
+class Question:
+    __slots__ = ('qname', 'qtype', 'qclass')
+
+    def __init__(self, qname, qtype=TYPE_A, qclass=1):
+        self.qname = qname
+        self.qtype = qtype
+        self.qclass = qclass
+
+class Record:
+    __slots__ = ('rrname', 'type', 'rclass', 'ttl', 'rdata')
+
+    def __init__(self, rrname, type, ttl, rdata, rclass=1):
+        self.rrname = rrname
+        self.type = type
+        self.rclass = rclass
+        self.ttl = ttl
+        self.rdata = rdata
+
+    @property
+    def minimum(self):
+        return self.rdata[6]
+
+    def copy(self):
+        return Record(self.rrname, self.type, self.ttl, self.rdata, self.rclass)
+
+def decode_name(data, offset):
+    labels = []
+    end = None
+    jumps = 0
+    length = len(data)
+
+    while True:
+        if offset >= length:
+            raise DNSWireError("name runs past end of message")
+        size = data[offset]
+        if size == 0:
+            offset += 1
+            break
+        if size & 0xC0 == 0xC0:
+            if offset + 1 >= length:
+                raise DNSWireError("truncated compression pointer")
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > MAX_POINTER_JUMPS:
+                raise DNSWireError("compression pointer loop")
+            offset = ((size & 0x3F) << 8) | data[offset + 1]
+            continue
+        if size & 0xC0:
+            raise DNSWireError("unsupported label type")
+        offset += 1
+        labels.append(bytes(data[offset:offset + size]).decode('ascii', 'backslashreplace'))
+        offset += size
+
+    return '.'.join(labels) + '.', end if end is not None else offset
+
+def skip_name(data, offset):
+    length = len(data)
+    while offset < length:
+        size = data[offset]
+        if size == 0:
+            return offset + 1
+        if size & 0xC0 == 0xC0:
+            return offset + 2
+        offset += size + 1
+    raise DNSWireError("name runs past end of message")
+
+def decode_rdata(data, rtype, offset, rdlength):
+    end = offset + rdlength
+    if rtype == TYPE_A and rdlength == 4:
+        return '%d.%d.%d.%d' % (data[offset], data[offset + 1], data[offset + 2], data[offset + 3])
+    if rtype == TYPE_AAAA and rdlength == 16:
+        return socket.inet_ntop(socket.AF_INET6, bytes(data[offset:end]))
+    if rtype in NAME_TYPES:
+        return decode_name(data, offset)[0]
+    if rtype == TYPE_MX:
+        if rdlength < MX_FIXED.size:
+            raise DNSWireError("truncated MX record")
+        return MX_FIXED.unpack_from(data, offset)[0], decode_name(data, offset + MX_FIXED.size)[0]
+    if rtype == TYPE_SOA:
+        mname, offset = decode_name(data, offset)
+        rname, offset = decode_name(data, offset)
+        if offset + SOA_FIXED.size > end:
+            raise DNSWireError("truncated SOA record")
+        return (mname, rname) + SOA_FIXED.unpack_from(data, offset)
+    return bytes(data[offset:end])
+
+class Message:
+    def __init__(self, data):
+        if len(data) < HEADER.size:
+            raise DNSWireError("message shorter than header")
+        self.data = memoryview(data)
+        self.id, self.flags, self.qdcount, self.ancount, self.nscount, self.arcount = HEADER.unpack_from(self.data)
+        self._sections = [None, None, None, None]
+        self._starts = [HEADER.size, None, None, None]
+
+    qr = property(lambda self: self.flags >> 15)
+    opcode = property(lambda self: (self.flags >> 11) & 0xF)
+    aa = property(lambda self: (self.flags >> 10) & 1)
+    tc = property(lambda self: (self.flags >> 9) & 1)
+    rd = property(lambda self: (self.flags >> 8) & 1)
+    ra = property(lambda self: (self.flags >> 7) & 1)
+    rcode = property(lambda self: self.flags & 0xF)
+
+    @property
+    def questions(self):
+        return self._section(0)
+
+    @property
+    def qd(self):
+        questions = self._section(0)
+        return questions[0] if questions else None
+
+    @property
+    def an(self):
+        return self._section(1)
+
+    @property
+    def ns(self):
+        return self._section(2)
+
+    @property
+    def ar(self):
+        return self._section(3)
+
+    @property
+    def opt(self):
+        for record in self._section(3):
+            if record.type == TYPE_OPT:
+                return record
+        return None
+
+    @property
+    def udp_size(self):
+        opt = self.opt
+        return max(opt.rclass, CLASSIC_UDP_SIZE) if opt else CLASSIC_UDP_SIZE
+
+    def _count(self, index):
+        return (self.qdcount, self.ancount, self.nscount, self.arcount)[index]
+
+    def _section_start(self, index):
+        start = self._starts[index]
+        if start is None:
+            start = self._section_start(index - 1)
+            data = self.data
+            for _ in range(self._count(index - 1)):
+                start = skip_name(data, start)
+                if index - 1 == 0:
+                    start += QUESTION_FIXED.size
+                else:
+                    start += RR_FIXED.size + struct.unpack_from('!H', data, start + 8)[0]
+            if start > len(data):
+                raise DNSWireError("section runs past end of message")
+            self._starts[index] = start
+        return start
+
+    def _section(self, index):
+        records = self._sections[index]
+        if records is not None:
+            return records
+
+        data = self.data
+        offset = self._section_start(index)
+        records = []
+        for _ in range(self._count(index)):
+            name, offset = decode_name(data, offset)
+            if index == 0:
+                if offset + QUESTION_FIXED.size > len(data):
+                    raise DNSWireError("truncated question")
+                qtype, qclass = QUESTION_FIXED.unpack_from(data, offset)
+                offset += QUESTION_FIXED.size
+                records.append(Question(name, qtype, qclass))
+                continue
+
+            if offset + RR_FIXED.size > len(data):
+                raise DNSWireError("truncated resource record")
+            rtype, rclass, ttl, rdlength = RR_FIXED.unpack_from(data, offset)
+            offset += RR_FIXED.size
+            if offset + rdlength > len(data):
+                raise DNSWireError("truncated rdata")
+            records.append(Record(name, rtype, ttl, decode_rdata(data, rtype, offset, rdlength), rclass))
+            offset += rdlength
+
+        self._sections[index] = records
+        if index < 3 and self._starts[index + 1] is None:
+            self._starts[index + 1] = offset
+        return records
+
+def encode_name(buf, name, offsets):
+    name = name.strip('.')
+    labels = name.split('.') if name else []
+
+    for i in range(len(labels)):
+        suffix = '.'.join(labels[i:]).lower()
+        pointer = offsets.get(suffix)
+        if pointer is not None:
+            buf += struct.pack('!H', 0xC000 | pointer)
+            return
+        if len(buf) < 0x4000:
+            offsets[suffix] = len(buf)
+        label = labels[i].encode('ascii')
+        if len(label) > 63:
+            raise DNSWireError(f"label too long: {labels[i]}")
+        buf.append(len(label))
+        buf += label
+    buf.append(0)
+
+def encode_record(buf, record, offsets):
+    encode_name(buf, record.rrname, offsets)
+    fixed_at = len(buf)
+    buf += RR_FIXED.pack(record.type, record.rclass, max(0, int(record.ttl)), 0)
+    rdata_at = len(buf)
+
+    rtype, rdata = record.type, record.rdata
+    if rtype == TYPE_A:
+        buf += socket.inet_aton(rdata)
+    elif rtype == TYPE_AAAA:
+        buf += socket.inet_pton(socket.AF_INET6, rdata)
+    elif rtype in NAME_TYPES:
+        encode_name(buf, rdata, offsets)
+    elif rtype == TYPE_MX:
+        buf += MX_FIXED.pack(rdata[0])
+        encode_name(buf, rdata[1], offsets)
+    elif rtype == TYPE_SOA:
+        encode_name(buf, rdata[0], offsets)
+        encode_name(buf, rdata[1], offsets)
+        buf += SOA_FIXED.pack(*rdata[2:7])
+    else:
+        buf += rdata
+
+    struct.pack_into('!H', buf, fixed_at + 8, len(buf) - rdata_at)
+
+def encode_message(qid, flags, questions=(), answers=(), authority=(), additional=()):
+    buf = bytearray(HEADER.pack(qid, flags, len(questions), len(answers), len(authority), len(additional)))
+    offsets = {}
+    for question in questions:
+        encode_name(buf, question.qname, offsets)
+        buf += QUESTION_FIXED.pack(question.qtype, question.qclass)
+    for section in (answers, authority, additional):
+        for record in section:
+            encode_record(buf, record, offsets)
+    return bytes(buf)
+
+def build_query(qname, qtype=TYPE_A, qid=0, rd=0):
+    return encode_message(qid, rd << 8, [Question(qname, qtype)])
+
+def build_response(query, rcode, answers=(), authority=(), additional=(), aa=0, tc=0):
+    flags = 0x8000 | (query.opcode << 11) | (aa << 10) | (tc << 9) | (query.rd << 8) | 0x0080 | rcode
+    return encode_message(query.id, flags, query.questions, answers, authority, additional)
+
+def query_message(qname, qtype=TYPE_A):
+    return Message(build_query(qname, qtype))
+
+def edns_record(udp_size=EDNS_UDP_SIZE):
+    return Record('.', TYPE_OPT, 0, b'', rclass=udp_size)
+
+def add_edns(data, udp_size=EDNS_UDP_SIZE):
+    arcount = struct.unpack_from('!H', data, 10)[0]
+    opt = b'\x00' + RR_FIXED.pack(TYPE_OPT, udp_size, 0, 0)
+    return bytes(data[:10]) + struct.pack('!H', arcount + 1) + bytes(data[12:]) + opt
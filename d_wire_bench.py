@@ -0,0 +1,71 @@
+import sys
+import timeit
+from scapy.all import DNS, DNSQR, DNSRR, raw
+
+from d_wire import Message, Record, build_query, build_response, TYPE_A
+
+ITERATIONS = 20000
+
+def sample_referral():
+    ns_names = [f"{c}.gtld-servers.net." for c in "abcdefghijklm"]
+    ns = None
+    ar = None
+    for i, name in enumerate(ns_names):
+        ns_rr = DNSRR(rrname='com.', type='NS', ttl=172800, rdata=name)
+        ar_rr = DNSRR(rrname=name, type='A', ttl=172800, rdata=f"192.5.6.{30 + i}")
+        ns = ns_rr if ns is None else ns / ns_rr
+        ar = ar_rr if ar is None else ar / ar_rr
+    return raw(DNS(id=1, qr=1, qd=DNSQR(qname='example.com.'), ns=ns, ar=ar))
+
+def scapy_referral(data):
+    pkt = DNS(data)
+    ns = [pkt.ns[i].rdata for i in range(pkt.nscount) if pkt.ns[i].type == 2]
+    glue = [pkt.ar[i].rdata for i in range(pkt.arcount) if pkt.ar[i].type == 1]
+    return ns, glue
+
+def wire_referral(data):
+    pkt = Message(data)
+    ns = [record.rdata for record in pkt.ns if record.type == 2]
+    glue = [record.rdata for record in pkt.ar if record.type == 1]
+    return ns, glue
+
+def scapy_header(data):
+    pkt = DNS(data)
+    return pkt.rcode, pkt.ancount, pkt.nscount
+
+def wire_header(data):
+    pkt = Message(data)
+    return pkt.rcode, pkt.ancount, pkt.nscount
+
+def scapy_reply(query):
+    pkt = DNS(query)
+    return raw(DNS(id=pkt.id, qr=1, ra=1, qd=pkt.qd, an=DNSRR(rrname=pkt.qd.qname, type='A', ttl=60, rdata='93.184.216.34')))
+
+def wire_reply(query):
+    pkt = Message(query)
+    return build_response(pkt, 0, answers=[Record(pkt.qd.qname, TYPE_A, 60, '93.184.216.34')])
+
+def run(label, func, arg, iterations):
+    seconds = timeit.timeit(lambda: func(arg), number=iterations)
+    per_op = seconds / iterations * 1e6
+    print(f"{label:<32} {per_op:10.2f} us/op")
+    return per_op
+
+def main(iterations=ITERATIONS):
+    referral = sample_referral()
+    query = build_query('www.example.com.', qid=4242, rd=1)
+
+    assert scapy_referral(referral)[1] == wire_referral(referral)[1]
+
+    print(f"Referral size: {len(referral)} bytes, {iterations} iterations\n")
+    for name, scapy_func, wire_func, arg in [
+        ("parse referral (NS + glue)", scapy_referral, wire_referral, referral),
+        ("parse header only", scapy_header, wire_header, referral),
+        ("parse query + build reply", scapy_reply, wire_reply, query),
+    ]:
+        scapy_us = run(f"scapy: {name}", scapy_func, arg, iterations)
+        wire_us = run(f"d_wire: {name}", wire_func, arg, iterations)
+        print(f"{'speedup':<32} {scapy_us / wire_us:10.1f}x\n")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ITERATIONS)
@@ -0,0 +1,93 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import time
+
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 30.0
+STABLE_AFTER = 60.0
+STOP_TIMEOUT = 5.0
+
+def worker_entry(target, args, index):
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    print(f"[WORKER {index}] pid {os.getpid()}")
+    target(args, index)
+
+class Supervisor:
+    def __init__(self, count, target, args):
+        self.count = count
+        self.target = target
+        self.args = args
+        self.context = multiprocessing.get_context('fork')
+        self.workers = {}
+        self.started = {}
+        self.delays = {}
+        self.pending = {}
+        self.restarts = 0
+
+    def spawn(self, index):
+        process = self.context.Process(target=worker_entry, args=(self.target, self.args, index), daemon=True)
+        process.start()
+        self.workers[index] = process
+        self.started[index] = time.monotonic()
+
+    def reap(self):
+        now = time.monotonic()
+        for index, process in list(self.workers.items()):
+            if process.is_alive():
+                continue
+            del self.workers[index]
+            delay = self.delays.get(index, RESTART_DELAY)
+            if now - self.started[index] > STABLE_AFTER:
+                delay = RESTART_DELAY
+            print(f"[SUPERVISOR] worker {index} (pid {process.pid}) exited with {process.exitcode}, restarting in {delay:.0f}s")
+            self.pending[index] = now + delay
+            self.delays[index] = min(delay * 2, MAX_RESTART_DELAY)
+
+        for index, restart_at in list(self.pending.items()):
+            if now >= restart_at:
+                del self.pending[index]
+                self.restarts += 1
+                self.spawn(index)
+
+    def run(self):
+        for index in range(self.count):
+            self.spawn(index)
+        print(f"[SUPERVISOR] {self.count} workers running")
+
+        while True:
+            sentinels = [process.sentinel for process in self.workers.values()]
+            multiprocessing.connection.wait(sentinels, timeout=RESTART_DELAY)
+            self.reap()
+
+    def forward(self, signum):
+        for process in self.workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def stop(self):
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for process in self.workers.values():
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        print(f"[SUPERVISOR] stopped {len(self.workers)} workers ({self.restarts} restarts)")
+
+def supervise(count, target, args):
+    supervisor = Supervisor(count, target, args)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGUSR1, lambda signum, frame: supervisor.forward(signum))
+    try:
+        supervisor.run()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        supervisor.stop()
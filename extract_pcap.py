@@ -1,5 +1,10 @@
 import os
-from scapy.all import PcapReader, DNS, DNSQR
+import sys
+import mmap
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from d_wire import DNSWireError, decode_name
 
 PCAP_FILES = {
     'PCAPs/PCAP_1_H1.pcap': 'urls_h1.txt',
@@ -8,34 +13,225 @@ PCAP_FILES = {
     'PCAPs/PCAP_4_H4.pcap': 'urls_h4.txt',
 }
 
-def extract():
+DNS_PORTS = (53, 5353)
+SPLIT_MIN_BYTES = 64 * 1024 * 1024
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': '<', b'\xa1\xb2\xc3\xd4': '>',
+    b'\x4d\x3c\xb2\xa1': '<', b'\xa1\xb2\x3c\x4d': '>',
+}
+PCAP_NANOSECOND = (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d')
+PCAPNG_SHB = b'\x0a\x0d\x0d\x0a'
+PCAPNG_TICK = 1e-6
+LINK_NULL, LINK_ETHERNET, LINK_RAW, LINK_RAW_ALT, LINK_LINUX_SLL, LINK_IPV4, LINK_IPV6, LINK_LINUX_SLL2 = 0, 1, 101, 12, 113, 228, 229, 276
+VLAN_TYPES = (0x8100, 0x88A8)
+IPPROTO_TCP, IPPROTO_UDP = 6, 17
+
+def ip_offset(frame, linktype):
+    if linktype == LINK_ETHERNET:
+        offset, ethertype = 14, int.from_bytes(frame[12:14], 'big')
+        while ethertype in VLAN_TYPES and len(frame) >= offset + 4:
+            ethertype = int.from_bytes(frame[offset + 2:offset + 4], 'big')
+            offset += 4
+        return offset if ethertype in (0x0800, 0x86DD) else None
+    if linktype in (LINK_RAW, LINK_RAW_ALT, LINK_IPV4, LINK_IPV6):
+        return 0
+    if linktype == LINK_LINUX_SLL:
+        return 16 if int.from_bytes(frame[14:16], 'big') in (0x0800, 0x86DD) else None
+    if linktype == LINK_LINUX_SLL2:
+        return 20 if int.from_bytes(frame[0:2], 'big') in (0x0800, 0x86DD) else None
+    if linktype == LINK_NULL:
+        return 4
+    return None
+
+def tcp_messages(segment):
+    offset = 0
+    while offset + 2 <= len(segment):
+        length = int.from_bytes(segment[offset:offset + 2], 'big')
+        if offset + 2 + length > len(segment):
+            return
+        yield segment[offset + 2:offset + 2 + length]
+        offset += 2 + length
+
+def dns_payloads(frame, linktype):
+    offset = ip_offset(frame, linktype)
+    if offset is None or len(frame) < offset + 28:
+        return
+
+    version = frame[offset] >> 4
+    if version == 4:
+        protocol = frame[offset + 9]
+        if int.from_bytes(frame[offset + 6:offset + 8], 'big') & 0x1FFF:
+            return
+        offset += (frame[offset] & 0x0F) * 4
+    elif version == 6:
+        protocol = frame[offset + 6]
+        offset += 40
+    else:
+        return
+
+    if protocol not in (IPPROTO_UDP, IPPROTO_TCP) or len(frame) < offset + 20:
+        return
+    sport = int.from_bytes(frame[offset:offset + 2], 'big')
+    dport = int.from_bytes(frame[offset + 2:offset + 4], 'big')
+    if sport not in DNS_PORTS and dport not in DNS_PORTS:
+        return
+
+    if protocol == IPPROTO_UDP:
+        messages = [frame[offset + 8:]]
+    else:
+        messages = tcp_messages(frame[offset + (frame[offset + 12] >> 4) * 4:])
+    for dns in messages:
+        if len(dns) >= 12 and not dns[2] & 0x80 and int.from_bytes(dns[4:6], 'big'):
+            yield dns
+
+def dns_query_names(frame, linktype):
+    for dns in dns_payloads(frame, linktype):
+        try:
+            name = decode_name(dns, 12)[0].rstrip('.')
+        except DNSWireError:
+            continue
+        if name:
+            yield name
+
+def pcap_records(buf, start, end, endian):
+    header = struct.Struct(endian + 'IIII')
+    offset = start
+    while offset + 16 <= end:
+        ts_sec, ts_frac, incl_len, _ = header.unpack_from(buf, offset)
+        offset += 16
+        yield offset, incl_len, ts_sec, ts_frac
+        offset += incl_len
+
+def pcapng_frames(buf):
+    offset = 0
+    endian = '<'
+    linktypes = []
+    while offset + 12 <= len(buf):
+        if buf[offset:offset + 4] == PCAPNG_SHB:
+            endian = '<' if buf[offset + 8:offset + 12] == b'\x4d\x3c\x2b\x1a' else '>'
+            linktypes = []
+        block_type, block_len = struct.unpack_from(endian + 'II', buf, offset)
+        if block_len < 12:
+            raise ValueError("corrupt pcapng block")
+        if block_type == 1:
+            linktypes.append(struct.unpack_from(endian + 'H', buf, offset + 8)[0])
+        elif block_type == 6:
+            interface, ts_high, ts_low, cap_len = struct.unpack_from(endian + 'IIII', buf, offset + 8)
+            yield buf[offset + 28:offset + 28 + cap_len], linktypes[interface], ((ts_high << 32) | ts_low) * PCAPNG_TICK
+        elif block_type == 3:
+            cap_len = min(struct.unpack_from(endian + 'I', buf, offset + 8)[0], block_len - 16)
+            yield buf[offset + 12:offset + 12 + cap_len], linktypes[0], None
+        offset += block_len
+
+def scan_range(job):
+    pcap_file, start, end = job
+    names = set()
+    with open(pcap_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:4] == PCAPNG_SHB:
+            frames = pcapng_frames(mm)
+        else:
+            endian = PCAP_MAGIC[mm[:4]]
+            linktype = struct.unpack_from(endian + 'I', mm, 20)[0] & 0x0FFFFFFF
+            frames = ((mm[offset:offset + length], linktype, None) for offset, length, _, _ in pcap_records(mm, start, end, endian))
+
+        for frame, linktype, _ in frames:
+            names.update(dns_query_names(frame, linktype))
+    return names
+
+def capture_frames(mm):
+    if mm[:4] == PCAPNG_SHB:
+        yield from pcapng_frames(mm)
+        return
+    if mm[:4] not in PCAP_MAGIC:
+        raise ValueError("unsupported capture format")
+    endian = PCAP_MAGIC[mm[:4]]
+    tick = 1e-9 if mm[:4] in PCAP_NANOSECOND else 1e-6
+    linktype = struct.unpack_from(endian + 'I', mm, 20)[0] & 0x0FFFFFFF
+    for offset, length, ts_sec, ts_frac in pcap_records(mm, 24, len(mm), endian):
+        yield mm[offset:offset + length], linktype, ts_sec + ts_frac * tick
+
+def plan_jobs(pcap_file, parts):
+    with open(pcap_file, 'rb') as f:
+        magic = f.read(4)
+        size = os.fstat(f.fileno()).st_size
+    if magic == PCAPNG_SHB:
+        return [(pcap_file, 0, size)]
+    if magic not in PCAP_MAGIC:
+        raise ValueError(f"unsupported capture format in {pcap_file}")
+    if parts <= 1 or size < SPLIT_MIN_BYTES:
+        return [(pcap_file, 24, size)]
+
+    with open(pcap_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        step = size // parts
+        bounds = [24]
+        for offset, *_ in pcap_records(mm, 24, size, PCAP_MAGIC[magic]):
+            if offset - 16 >= bounds[-1] + step:
+                bounds.append(offset - 16)
+        bounds.append(size)
+    return [(pcap_file, a, b) for a, b in zip(bounds, bounds[1:])]
+
+def extract_scapy(pcap_file):
+    from scapy.all import PcapReader, DNS, DNSQR
+
+    unq = set()
+    with PcapReader(pcap_file) as pcap_reader:
+        for pkt in pcap_reader:
+            if pkt.haslayer(DNS) and pkt[DNS].qr == 0 and pkt.haslayer(DNSQR):
+                try:
+                    qname = pkt[DNSQR].qname.decode('utf-8').rstrip('.')
+                    if qname:
+                        unq.add(qname)
+
+                except Exception:
+                    pass
+    return unq
+
+def write_domains(out_file, unq):
+    with open(out_file, 'w') as f:
+        for domain in sorted(unq):
+            f.write(f"{domain}\n")
+
+def extract(use_scapy=False, workers=None):
     print("Starting...")
+    workers = workers or os.cpu_count() or 1
+
+    if use_scapy:
+        for pcap_file, out_file in PCAP_FILES.items():
+            print(f"Processing {pcap_file}: {out_file}")
+            try:
+                unq = extract_scapy(pcap_file)
+                write_domains(out_file, unq)
+                print(f"Done, got {len(unq)} unique domains")
+            except Exception as e:
+                print(f"Error processing {pcap_file}: {e}")
+        return
+
+    results, jobs = {}, []
+    for pcap_file in PCAP_FILES:
+        try:
+            jobs.extend(plan_jobs(pcap_file, workers))
+            results[pcap_file] = set()
+        except Exception as e:
+            print(f"Fast path unavailable for {pcap_file} ({e}), falling back to scapy")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(job[0], pool.submit(scan_range, job)) for job in jobs]
+        for pcap_file, future in futures:
+            try:
+                if pcap_file in results:
+                    results[pcap_file] |= future.result()
+            except Exception as e:
+                print(f"Fast path failed for {pcap_file} ({e}), falling back to scapy")
+                results.pop(pcap_file, None)
 
     for pcap_file, out_file in PCAP_FILES.items():
         print(f"Processing {pcap_file}: {out_file}")
-        
-        unq = set()
-        
         try:
-            with PcapReader(pcap_file) as pcap_reader:
-                for pkt in pcap_reader:
-                    if pkt.haslayer(DNS) and pkt[DNS].qr == 0 and pkt.haslayer(DNSQR):
-                        try:
-                            qname = pkt[DNSQR].qname.decode('utf-8').rstrip('.')
-                            if qname:
-                                unq.add(qname)
-
-                        except Exception:
-                            pass
-
-            with open(out_file, 'w') as f:
-                for domain in sorted(unq):
-                    f.write(f"{domain}\n")
-            
+            unq = results[pcap_file] if pcap_file in results else extract_scapy(pcap_file)
+            write_domains(out_file, unq)
             print(f"Done, got {len(unq)} unique domains")
-
         except Exception as e:
             print(f"Error processing {pcap_file}: {e}")
 
 if __name__ == "__main__":
-    extract()
+    extract(use_scapy='--scapy' in sys.argv[1:])
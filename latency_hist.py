@@ -0,0 +1,97 @@
+import csv
+import json
+
+PRECISION_BITS = 7
+PERCENTILES = (50, 90, 99, 99.9)
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value_us):
+        value = max(0, int(value_us))
+        shift = value.bit_length() - PRECISION_BITS
+        bucket = (value >> shift) << shift if shift > 0 else value
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for bucket, n in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * p // 100))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(bucket_upper(bucket), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def cdf(self):
+        points = []
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            points.append((min(bucket_upper(bucket), self.max) / 1000, seen / self.count))
+        return points
+
+    def summary(self):
+        summary = {
+            "count": self.count,
+            "min_ms": (self.min or 0) / 1000,
+            "mean_ms": self.mean() / 1000,
+            "max_ms": self.max / 1000,
+        }
+        for p in PERCENTILES:
+            summary[f"p{p:g}_ms"] = self.percentile(p) / 1000
+        return summary
+
+    def format_summary(self):
+        s = self.summary()
+        return (f"p50 {s['p50_ms']:.3f} ms | p90 {s['p90_ms']:.3f} ms | p99 {s['p99_ms']:.3f} ms | "
+                f"p99.9 {s['p99.9_ms']:.3f} ms | max {s['max_ms']:.3f} ms")
+
+def bucket_upper(bucket):
+    shift = bucket.bit_length() - PRECISION_BITS
+    return bucket + (1 << shift) - 1 if shift > 0 else bucket
+
+def merge_histograms(histograms):
+    merged = LatencyHistogram()
+    for histogram in histograms:
+        merged.merge(histogram)
+    return merged
+
+def write_results(path, results, histogram):
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["metric", "value"])
+            for name, value in {**results, **histogram.summary()}.items():
+                writer.writerow([name, value])
+            writer.writerow([])
+            writer.writerow(["latency_ms", "cumulative_fraction"])
+            writer.writerows(histogram.cdf())
+    else:
+        with open(path, 'w') as f:
+            json.dump({"results": results, "latency": histogram.summary(), "cdf": histogram.cdf()}, f, indent=2)
@@ -0,0 +1,124 @@
+import ipaddress
+
+from mininet.net import Mininet
+from mininet.link import TCLink
+from mininet.log import info
+
+SHAPES = ('linear', 'tree', 'star')
+SUBNET = '10.0.0.0/24'
+RESOLVER_IP = '10.0.0.5'
+NAT_IP = '10.0.0.6'
+CLIENTS = 4
+SWITCHES = 4
+FANOUT = 2
+BANDWIDTH = 100
+ACCESS_DELAY = '2ms'
+RESOLVER_DELAY = '1ms'
+TRUNK_DELAYS = ('5ms', '8ms', '10ms')
+CONFIG_BATCH = 32
+PING_WAIT = 1
+
+def client_ips(count, reserved):
+    network = ipaddress.ip_network(SUBNET)
+    free = (str(ip) for ip in network.hosts() if str(ip) not in reserved)
+    ips = [ip for _, ip in zip(range(count), free)]
+    if len(ips) < count:
+        raise ValueError(f"{SUBNET} has room for only {len(ips)} clients")
+    return [f"{ip}/{network.prefixlen}" for ip in ips]
+
+def add_switches(net, shape, count, fanout, bw, trunk_delays):
+    if shape == 'star' or count <= 1:
+        switch = net.addSwitch('s1')
+        return switch, [switch]
+
+    switches = [net.addSwitch(f's{i}') for i in range(1, count + 1)]
+    if shape == 'linear':
+        for i, (a, b) in enumerate(zip(switches, switches[1:])):
+            net.addLink(a, b, bw=bw, delay=trunk_delays[i % len(trunk_delays)])
+        return switches[1], switches
+
+    depths = [0]
+    for i in range(1, count):
+        parent = (i - 1) // max(fanout, 1)
+        depths.append(depths[parent] + 1)
+        net.addLink(switches[parent], switches[i], bw=bw, delay=trunk_delays[depths[parent] % len(trunk_delays)])
+    leaves = switches[(count - 2) // max(fanout, 1) + 1:]
+    return switches[0], leaves
+
+def run_batched(hosts, commands, batch=CONFIG_BATCH):
+    outputs = {}
+    for i in range(0, len(hosts), batch):
+        chunk = hosts[i:i + batch]
+        for h in chunk:
+            h.sendCmd(commands[h])
+        for h in chunk:
+            outputs[h] = h.waitOutput()
+    return outputs
+
+def configure_hosts(hosts, nameserver, gateway=NAT_IP):
+    command = f"echo 'nameserver {nameserver}' > /etc/resolv.conf; ip route add default via {gateway}"
+    run_batched(hosts, {h: command for h in hosts})
+
+def check_connectivity(clients, resolver, gateway=NAT_IP):
+    command = "ping -c1 -W{} {} > /dev/null && echo ok || echo unreachable"
+    commands = {h: command.format(PING_WAIT, resolver.IP()) for h in clients}
+    commands[resolver] = command.format(PING_WAIT, gateway)
+    outputs = run_batched(list(commands), commands)
+    unreachable = [h.name for h, output in outputs.items() if 'ok' not in output.split()]
+    info(f'Connectivity: {len(outputs) - len(unreachable)}/{len(outputs)} hosts reach '
+         f'{resolver.name} ({resolver.IP()}) or the gateway\n')
+    if unreachable:
+        info(f'Unreachable: {" ".join(unreachable)}\n')
+    return unreachable
+
+def build_topology(clients=CLIENTS, shape='linear', switches=SWITCHES, fanout=FANOUT, bw=BANDWIDTH,
+                   delay=ACCESS_DELAY, trunk_delays=TRUNK_DELAYS, resolver_ip=RESOLVER_IP, nameserver=None):
+    if shape not in SHAPES:
+        raise ValueError(f"unknown topology shape: {shape}")
+    prefixlen = ipaddress.ip_network(SUBNET).prefixlen
+    net = Mininet(link=TCLink)
+
+    info('Adding controller\n')
+    net.addController('c0')
+
+    info(f'Adding {shape} switches\n')
+    core, edges = add_switches(net, shape, switches, fanout, bw, trunk_delays)
+
+    info(f'Adding {clients} hosts\n')
+    hosts = []
+    for i, ip in enumerate(client_ips(clients, (resolver_ip, NAT_IP)), start=1):
+        host = net.addHost(f'h{i}', ip=ip)
+        net.addLink(host, edges[(i - 1) % len(edges)], bw=bw, delay=delay)
+        hosts.append(host)
+    dns_host = net.addHost('dns', ip=f'{resolver_ip}/{prefixlen}')
+    net.addLink(core, dns_host, bw=bw, delay=RESOLVER_DELAY)
+
+    nat = net.addNAT(connect=core)
+
+    info('Starting network\n')
+    net.start()
+    nat.configDefault()
+
+    nat.cmd(f'ifconfig nat-eth0 {NAT_IP}/{prefixlen}')
+
+    # Forwards DNS packets through NAT
+    nat.cmd('iptables -t nat -A POSTROUTING -o eth0 -j MASQUERADE')
+    nat.cmd('iptables -A FORWARD -i nat-eth0 -o eth0 -j ACCEPT')
+    nat.cmd('iptables -A FORWARD -i eth0 -o nat-eth0 -m state --state ESTABLISHED,RELATED -j ACCEPT')
+
+    configure_hosts(hosts + [dns_host], nameserver or resolver_ip)
+    check_connectivity(hosts, dns_host)
+
+    return net
+
+def add_topology_arguments(parser):
+    parser.add_argument('--clients', type=int, default=CLIENTS, help="client hosts h1..hN")
+    parser.add_argument('--shape', choices=SHAPES, default='linear')
+    parser.add_argument('--switches', type=int, default=SWITCHES, help="switch count for linear and tree shapes")
+    parser.add_argument('--fanout', type=int, default=FANOUT, help="children per switch in a tree")
+    parser.add_argument('--bw', type=float, default=BANDWIDTH, help="link bandwidth in Mbit/s")
+    parser.add_argument('--delay', default=ACCESS_DELAY, help="client access link delay")
+
+def topology_options(args):
+    return {"clients": args.clients, "shape": args.shape, "switches": args.switches,
+            "fanout": args.fanout, "bw": args.bw, "delay": args.delay}